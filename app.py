@@ -1,26 +1,43 @@
-import json
+import html
 import os
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
 import gradio as gr
-import ollama
-from utils import get_video_id, get_video_info
+from metadata import get_resolver
 from manager import TaskManager
-from task import SummarizationTask
+from jobqueue import PRIORITIES
+from task import STAGES, SummarizationTask
 from utils import load_config
+from store import SORT_ORDERS, get_store
+from artifacts import artifact_cache
+from search import get_search_index, highlight
+from pipeline import SUMMARY_MODES
+from llm import DERIVED_PREFIX, get_client
+import coordinator
+import metrics
+import progress
 
 NO_VIDEOS_ID = "__<NO_VIDEOS>__"
+BROWSE_PAGE_SIZE = 100
+SEARCH_LIMIT = 20
 
 whisper_cfg = load_config("whisper.json")
 
 def get_local_models():
-    models = ollama.list()
-    return [model["name"] for model in models["models"]]
+    models = get_client().list()
+    return [model["name"] for model in models["models"] if not model["name"].startswith(DERIVED_PREFIX)]
 
 task_manager = TaskManager()
+metrics_server = metrics.start_http_server() if metrics.METRICS_PORT else None
+# Remote workers lease jobs from the same queue (see coordinator.py)
+remote = coordinator.Coordinator(task_manager.jobs).start() if coordinator.ENABLED else None
+
+def get_remote_tasks():
+    return remote.active() if remote else []
 
 def refresh_table():
     table_data = task_manager.get_table()
-    table_list = [[task["Video ID"], task["Status"], task["Title"], task["Language"]] for task in table_data] + ([[task_manager.current_task.video_id, task_manager.current_task.status, task_manager.current_task.title, task_manager.current_task.language]] if task_manager.current_task else [])
+    active_tasks = task_manager.get_active_tasks()
+    table_list = [[task.video_id, task.status, task.title, task.language] for task in active_tasks] + [[job["video_id"], f"{job['status']} ({job['worker']})", job["title"], job["language"]] for job in get_remote_tasks()] + [[task["Video ID"], task["Status"], task["Title"], task["Language"]] for task in table_data]
     return table_list
 
 #task_manager.on_status_change = refresh_table
@@ -33,87 +50,154 @@ def start_stop_processing():
         return "Start"
     else:
         task_manager.start_processing()
-        return "Stop"
+        return "Stop" if task_manager.processing else "Start"
+
+def add_task(video_ids, abstract, model_id, language, sum_model_id, chunk_size, overlap, mode, concurrency, priority):
+    # Tasks are queued right away; titles and durations that are not cached yet are filled in as lookups finish
+    tasks = {}
+
+    def enqueue(video_id, details):
+        task = SummarizationTask(video_id, (details or {}).get("title"), language, model_id, sum_model_id, chunk_size, overlap, abstract, task_manager.on_status_change, mode=mode, concurrency=concurrency)
+        tasks[video_id] = task_manager.add_task(task, priority=PRIORITIES[priority], duration=(details or {}).get("duration"))
+
+    def update(video_id, details):
+        task_manager.set_details(tasks[video_id], details["title"], details["duration"])
 
-def add_task(video_id, abstract, model_id, language, sum_model_id, chunk_size, overlap):
-    video_id = get_video_id(video_id)
-    video_title = get_video_info(video_id)
-    task_manager.add_task(SummarizationTask(video_id, video_title, language, model_id, sum_model_id, chunk_size, overlap, abstract, task_manager.on_status_change))
+    try:
+        get_resolver().ingest(video_ids, enqueue, update)
+    except ValueError as e:
+        raise gr.Error(str(e))
     choices = [task["Video ID"] for task in task_manager.get_table()]
     return "", refresh_table(), gr.Dropdown(label="Remove from queue", choices=choices, interactive=True, value=choices[0] if choices else "")
 
 def get_total_tasks():
-    return f"**Total Tasks:** {len(task_manager.get_table()) + (1 if task_manager.current_task else 0)}"
+    return f"**Total Tasks:** {len(task_manager.get_table()) + len(task_manager.get_active_tasks()) + len(get_remote_tasks())}"
 
 def get_status():
-    if not task_manager.current_task:
+    video_ids = [task.video_id for task in task_manager.get_active_tasks()] + [f"{job['video_id']} on {job['worker']}" for job in get_remote_tasks()]
+    if not video_ids:
         return "**Status:** Idle"
-    return f"**Status:** Processing {task_manager.current_task.video_id}"
+    return f"**Status:** Processing {', '.join(video_ids)}"
 
 def remove_task(video_id):
     task_manager.remove_task(video_id)
     choices = [task["Video ID"] for task in task_manager.get_table()]
     return gr.Dropdown(label="Remove from queue", choices=choices, interactive=True, value=choices[0] if choices else ""), refresh_table()
 
+def prioritize_task(video_id):
+    task_manager.set_priority(video_id, PRIORITIES["High"])
+    return refresh_table()
+
 def get_button_text():
     return "Stop" if task_manager.processing else "Start"
 
-def get_items():
-    if os.path.exists("map.json"):
-        with open("map.json", "r") as f:
-            video_map = json.load(f)
-
-            items = [{"title": item["title"], "video_id": video_id, "has_abstract": item["abstract"]} for video_id, item in video_map.items()]
-            items.reverse()
-            return items
-
-    else:
+def get_items(page=1, order="Newest"):
+    items = get_store().list(offset=(max(int(page or 1), 1) - 1) * BROWSE_PAGE_SIZE, limit=BROWSE_PAGE_SIZE, order=order)
+    if not items:
         return [{"title": "No videos found", "video_id": NO_VIDEOS_ID, "has_abstract": False}]
+    return [{"title": item["title"], "video_id": item["video_id"], "has_abstract": bool(item["has_abstract"])} for item in items]
 
 
 def get_summaries(item):
-    if item == NO_VIDEOS_ID:
+    if item == NO_VIDEOS_ID or not item:
         return "", ""
-    video_id = item
-    summary, abstract = "", ""
-    try:
-        with open(f"summaries/{video_id}.md", "r") as f:
-            summary = f.read()
-    except:
-        pass
-    try:
-        with open(f"abstracts/{video_id}.md", "r") as f:
-            abstract = f.read()
-    except:
-        pass
-    return summary, abstract
+    # While a summary is being generated, show what has been streamed so far
+    streaming = progress.channel.get(item)
+    texts = streaming[1] if streaming else {}
+    return (texts["summary"] if "summary" in texts else artifact_cache.read(item, "summary"),
+            texts["abstract"] if "abstract" in texts else artifact_cache.read(item, "abstract"))
 
-selected_item = NO_VIDEOS_ID
+def item_signature(item):
+    streaming = progress.channel.get(item)
+    return (item, artifact_cache.signature(item), streaming[0] if streaming else None)
 
-def update_tabs(item):
-    global selected_item
-    selected_item = item
+def update_tabs(item, state):
     summary, abstract = get_summaries(item)
-    return gr.Markdown(value=abstract), gr.Markdown(value=summary), gr.update(visible=True)
+    state = dict(state or {}, item=item_signature(item))
+    return gr.Markdown(value=abstract), gr.Markdown(value=summary), gr.update(visible=True), state
 
-def get_markdown_abs():
-    global selected_item
-    _, abstract = get_summaries(selected_item)
-    return abstract
-
-def get_markdown_sum():
-    global selected_item
-    summary, _ = get_summaries(selected_item)
-    return summary
-
-def get_html():
+def render_list(page=1, order="Newest"):
     return """
     <div style="height: 100%; overflow-y: scroll;">
         <ul>
             {0}
         </ul>
     </div>  
-    """.format("".join([f"<li data-vid='{item['video_id']}' class='summary-list-item' onclick='document.selectItem(\"{item['video_id']}\")'>{item['title']}</li>" for item in get_items()]))
+    """.format("".join([f"<li data-vid='{html.escape(item['video_id'])}' class='summary-list-item' onclick='document.selectItem(\"{html.escape(item['video_id'])}\")'>{html.escape(item['title'] or item['video_id'])}</li>" for item in get_items(page, order)]))
+
+def render_in_progress(video_ids):
+    if not video_ids:
+        return ""
+    titles = {task.video_id: task.title for task in task_manager.get_active_tasks()}
+    return "<p><strong>In progress</strong></p><ul>{0}</ul>".format("".join([
+        f"<li data-vid='{html.escape(video_id)}' class='summary-list-item' onclick='document.selectItem(\"{html.escape(video_id)}\")'>{html.escape(titles.get(video_id) or video_id)}</li>"
+        for video_id in video_ids]))
+
+def get_html(page=1, order="Newest"):
+    # The rendered list is shared by every client until the library changes
+    return artifact_cache.rendered_view((page, order), get_store().last_modified(), lambda: render_list(page, order))
+
+def search_library(query):
+    if not query or not query.strip():
+        return ""
+    results = get_search_index().search(query, limit=SEARCH_LIMIT)
+    if not results:
+        return "<p>No matches</p>"
+    return "<ul>{0}</ul>".format("".join([
+        f"<li data-vid='{html.escape(r['video_id'])}' class='summary-list-item' onclick='document.selectItem(\"{html.escape(r['video_id'])}\")'>"
+        f"<strong>{html.escape(r['title'] or r['video_id'])}</strong> <small>({r['kind']})</small><br/><small>{highlight(r['snippet'])}</small></li>"
+        for r in results]))
+
+def refresh_browse(page, order, item, state):
+    # Polled by each client; only pushes components whose underlying data changed
+    state = dict(state or {})
+    active = progress.channel.active()
+    list_signature = (page, order, get_store().last_modified(), tuple(active))
+    list_update = gr.update()
+    if state.get("list") != list_signature:
+        list_update = render_in_progress(active) + get_html(page, order)
+        state["list"] = list_signature
+    abs_update, sum_update = gr.update(), gr.update()
+    if item and item != NO_VIDEOS_ID:
+        signature = item_signature(item)
+        if state.get("item") != signature:
+            summary, abstract = get_summaries(item)
+            abs_update, sum_update = abstract, summary
+            state["item"] = signature
+    return list_update, abs_update, sum_update, state
+
+def render_page_info():
+    count = get_store().count()
+    pages = max(1, -(-count // BROWSE_PAGE_SIZE))
+    return f"**{count} videos, {pages} pages**"
+
+def get_page_info():
+    return artifact_cache.rendered_view("page_info", get_store().last_modified(), render_page_info)
+
+def _fmt(value, spec=".2f"):
+    return "-" if value is None else format(value, spec)
+
+def render_metrics():
+    occupancy = metrics.stage_occupancy.collect()
+    depths = metrics.queue_depth.collect()
+    rows = ["| Stage | Running | Queued | Count | Mean (s) | p50 (s) | p95 (s) |", "|---|---|---|---|---|---|---|"]
+    for stage in STAGES:
+        count, total, _ = metrics.stage_duration.snapshot(stage=stage)
+        queued = depths.get(("pending",) if stage == "download" else (stage,), 0)
+        rows.append(f"| {stage} | {occupancy.get((stage,), 0)} | {queued} | {count} | {_fmt(total / count if count else None)} "
+                    f"| {_fmt(metrics.stage_duration.quantile(0.5, stage=stage))} | {_fmt(metrics.stage_duration.quantile(0.95, stage=stage))} |")
+    audio, wall, skipped = metrics.asr_audio_seconds.get(), metrics.asr_wall_seconds.get(), metrics.asr_skipped_seconds.get()
+    lines = ["### Stages", *rows, "", "### ASR",
+             f"{audio:.0f} s of audio in {wall:.1f} s, **{_fmt(audio / wall if wall else None, '.1f')}x** real time; "
+             f"{skipped:.0f} s skipped as silence ({_fmt(100 * skipped / (audio + skipped) if audio + skipped else None, '.0f')}%)", "", "### LLM",
+             "| Model | Prompt tokens | Generated tokens | Prompt tok/s (p50) | Gen tok/s (p50) | TTFT p50 (s) | Request p95 (s) |", "|---|---|---|---|---|---|---|"]
+    for labels in metrics.llm_request_duration.label_sets():
+        lines.append(f"| {labels['model']} | {metrics.llm_prompt_tokens.get(**labels)} | {metrics.llm_eval_tokens.get(**labels)} "
+                     f"| {_fmt(metrics.llm_prompt_rate.quantile(0.5, **labels), '.0f')} | {_fmt(metrics.llm_eval_rate.quantile(0.5, **labels), '.0f')} "
+                     f"| {_fmt(metrics.llm_first_token.quantile(0.5, **labels))} | {_fmt(metrics.llm_request_duration.quantile(0.95, **labels))} |")
+    finished = ", ".join(f"{outcome}: {count}" for (outcome,), count in sorted(metrics.tasks_finished.collect().items()))
+    lines += ["", f"Finished tasks: {finished or 'none'}"]
+    return "\n".join(lines)
 
 js = """
 document.selectItem = (video_id) => {
@@ -141,13 +225,17 @@ with gr.Blocks(js=js) as app:
                 gr.Markdown("# New Video Summary Task")
             with gr.Row():
                 with gr.Column() as new_task:
-                    video_id_input = gr.Textbox(label="YouTube Video ID or URL", placeholder="e.g. dQw4w9WgXcQ", min_width=500, interactive=True)
+                    video_id_input = gr.Textbox(label="YouTube Video IDs or URLs", placeholder="e.g. dQw4w9WgXcQ, one per line; playlist and channel URLs add all their videos", lines=3, min_width=500, interactive=True)
                     abstract = gr.Checkbox(label="Generate Abstract", interactive=True, value=True)
                     model_id = gr.Dropdown(label="Whisper Model ID", choices=whisper_cfg.get("models", ["openai/whisper-large-v3"]), interactive=True, value=whisper_cfg["models"][0], min_width=500)
                     language = gr.Dropdown(label="Language", choices=whisper_cfg.get("languages", ["en"]), interactive=True, value="en")
-                    sum_model_id = gr.Dropdown(label="Ollama Model ID", choices=get_local_models(), interactive=True, value=get_local_models()[0], min_width=500)
+                    local_models = get_local_models()
+                    sum_model_id = gr.Dropdown(label="Ollama Model ID", choices=local_models, interactive=True, value=local_models[0] if local_models else None, min_width=500)
                     chunk_size = gr.Slider(label="Chunk Size", minimum=3000, maximum=10000, step=100, interactive=True, value=6000)
                     overlap = gr.Slider(label="Overlap", minimum=0, maximum=1000, step=100, interactive=True, value=500)
+                    mode = gr.Dropdown(label="Summarization Mode", choices=list(SUMMARY_MODES), interactive=True, value=SUMMARY_MODES[0])
+                    concurrency = gr.Slider(label="Concurrent LLM Requests (map-reduce)", minimum=1, maximum=16, step=1, interactive=True, value=4)
+                    priority = gr.Dropdown(label="Priority", choices=list(PRIORITIES), interactive=True, value="Normal")
                 with gr.Column():
                     with gr.Row():
                         with gr.Column():
@@ -167,6 +255,7 @@ with gr.Blocks(js=js) as app:
                                 task_to_remove = gr.Dropdown(label="Remove from queue", choices=[task["Video ID"] for task in task_manager.get_table()], interactive=True)
                             with gr.Column():
                                 remove_task_button = gr.Button("Remove Task", interactive=True)
+                                prioritize_task_button = gr.Button("Move to High Priority", interactive=True)
                                 
             with gr.Row():
                 gr.Markdown("# Task Queue")
@@ -175,7 +264,7 @@ with gr.Blocks(js=js) as app:
                     table = gr.DataFrame(headers=["Video ID", "Status", "Title", "Language"], interactive=False, value=refresh_table, every=1)
             add_task_button.click(
                 fn=add_task,
-                inputs=[video_id_input, abstract, model_id, language, sum_model_id, chunk_size, overlap],
+                inputs=[video_id_input, abstract, model_id, language, sum_model_id, chunk_size, overlap, mode, concurrency, priority],
                 outputs=[video_id_input, table, task_to_remove]
             )
             remove_task_button.click(
@@ -183,20 +272,44 @@ with gr.Blocks(js=js) as app:
                 inputs=[task_to_remove],
                 outputs=[task_to_remove, table]
             )
+            prioritize_task_button.click(
+                fn=prioritize_task,
+                inputs=[task_to_remove],
+                outputs=[table]
+            )
         with gr.TabItem("Browse"):
             with gr.Row():
                 gr.Markdown("# Browse Summaries")
             with gr.Row():
                 with gr.Column(scale=1):
-                    gr.HTML(value=get_html, every=1)
+                    search_box = gr.Textbox(label="Search", placeholder="Search transcripts, summaries and abstracts", interactive=True)
+                    search_results = gr.HTML()
+                    with gr.Row():
+                        browse_order = gr.Dropdown(label="Sort", choices=list(SORT_ORDERS), value="Newest", interactive=True)
+                        browse_page = gr.Number(label="Page", value=1, minimum=1, precision=0, interactive=True)
+                    gr.Markdown(value=get_page_info, every=5)
+                    browse_list = gr.HTML()
                 with gr.Column(scale=3):
                     with gr.Tabs(visible=False, elem_id="tabs") as tabs:
                         with gr.TabItem("Short Summary"):
-                            short_summary_md = gr.Markdown(elem_id="short_summary_md", value=get_markdown_abs, every=0.5)
+                            short_summary_md = gr.Markdown(elem_id="short_summary_md")
                         with gr.TabItem("Detailed Summary"):
-                            detailed_summary_md = gr.Markdown(elem_id="detailed_summary_md", value=get_markdown_sum, every=0.5)
+                            detailed_summary_md = gr.Markdown(elem_id="detailed_summary_md")
             item_input = gr.Textbox(visible=False, elem_id="item_input")
-            item_input.change(update_tabs, inputs=item_input, outputs=[short_summary_md, detailed_summary_md, tabs])
+            browse_state = gr.State({})
+            item_input.change(update_tabs, inputs=[item_input, browse_state], outputs=[short_summary_md, detailed_summary_md, tabs, browse_state])
+            browse_order.change(get_html, inputs=[browse_page, browse_order], outputs=browse_list)
+            browse_page.change(get_html, inputs=[browse_page, browse_order], outputs=browse_list)
+            search_box.change(search_library, inputs=search_box, outputs=search_results)
+        with gr.TabItem("Metrics"):
+            with gr.Row():
+                gr.Markdown("# Metrics")
+            with gr.Row():
+                gr.Markdown(value=render_metrics, every=2)
+            with gr.Row():
+                gr.Markdown(f"Prometheus metrics are served on port {metrics.METRICS_PORT} at `/metrics`." if metrics_server else
+                            "Set `METRICS_PORT` to serve Prometheus metrics at `/metrics`.")
+    app.load(refresh_browse, inputs=[browse_page, browse_order, item_input, browse_state], outputs=[browse_list, short_summary_md, detailed_summary_md, browse_state], every=1)
     
     app.css = """
     .summary-list-item {
@@ -0,0 +1,82 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Number of artifact files kept in memory
+MAX_CACHED_FILES = 256
+
+ARTIFACT_PATHS = {
+    "transcript": "transcripts/{video_id}.txt",
+    "summary": "summaries/{video_id}.md",
+    "abstract": "abstracts/{video_id}.md",
+}
+
+
+def artifact_path(video_id, kind):
+    return ARTIFACT_PATHS[kind].format(video_id=video_id)
+
+
+class ArtifactCache:
+    # Shared in-process cache of artifact files and rendered views. Entries are invalidated when
+    # the pipeline reports a write through notify(), or when a file's mtime or size changes.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = OrderedDict()
+        self.versions = {}
+        self.rendered = {}
+        self.rendered_signature = None
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def read(self, video_id, kind):
+        path = artifact_path(video_id, kind)
+        stat = self._stat(path)
+        if stat is None:
+            return ""
+        with self.lock:
+            cached = self.files.get(path)
+            if cached and cached[0] == stat:
+                self.files.move_to_end(path)
+                return cached[1]
+        with open(path, "r") as f:
+            text = f.read()
+        with self.lock:
+            self.files[path] = (stat, text)
+            while len(self.files) > MAX_CACHED_FILES:
+                self.files.popitem(last=False)
+        return text
+
+    def signature(self, video_id, kinds=("summary", "abstract")):
+        # Changes whenever any of the video's artifacts change, without reading them
+        with self.lock:
+            version = self.versions.get(video_id, 0)
+        return (version,) + tuple(self._stat(artifact_path(video_id, kind)) for kind in kinds)
+
+    def notify(self, video_id, kind=None):
+        with self.lock:
+            if kind is not None:
+                self.files.pop(artifact_path(video_id, kind), None)
+            self.versions[video_id] = self.versions.get(video_id, 0) + 1
+
+    def rendered_view(self, key, signature, render):
+        # Render once per key until the signature (e.g. the library's last change) moves on;
+        # every client shares the result
+        with self.lock:
+            if signature != self.rendered_signature:
+                self.rendered = {}
+                self.rendered_signature = signature
+            if key in self.rendered:
+                return self.rendered[key]
+        value = render()
+        with self.lock:
+            if signature == self.rendered_signature:
+                self.rendered[key] = value
+        return value
+
+
+artifact_cache = ArtifactCache()
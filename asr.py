@@ -0,0 +1,255 @@
+import functools
+import gc
+import math
+import os
+import sys
+import threading
+from collections import OrderedDict
+from logging import getLogger
+
+from utils import lazy_import
+
+logger = getLogger(__name__)
+
+# "auto" picks cuda, then mps, then cpu. A dtype of None picks float16 on cuda and float32 elsewhere;
+# "int8" loads a dynamically quantized copy of the model on the cpu.
+DEFAULT_DEVICE = os.environ.get("ASR_DEVICE", "auto")
+DEFAULT_DTYPE = os.environ.get("ASR_DTYPE") or None
+QUANTIZED_DTYPE = "int8"
+# Pipeline settings that change the decoded text; part of the transcript cache key
+DECODING_PARAMS = {"max_new_tokens": 128, "chunk_length_s": 30, "return_timestamps": True}
+# Long audio is transcribed in segments of about this many seconds, and progress is checkpointed
+# after each; also part of the transcript cache key
+SEGMENT_SECONDS = int(os.environ.get("ASR_SEGMENT_SECONDS", "300"))
+# Total size of model weights allowed to stay resident, in GB
+DEFAULT_MEMORY_BUDGET_GB = float(os.environ.get("ASR_MEMORY_BUDGET_GB", "16"))
+# Intra-op threads for cpu inference; 0 uses every core
+CPU_THREADS = int(os.environ.get("ASR_THREADS", "0"))
+# Fixed batch size, or 0 to size batches from free memory and audio length
+BATCH_SIZE = int(os.environ.get("ASR_BATCH_SIZE", "0"))
+MAX_BATCH_SIZE = {"cuda": 32, "mps": 16, "cpu": 4}
+# Rough activation memory per 30 s window in a batch, per byte of model weights
+WINDOW_MEMORY_RATIO = 0.15
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_device(device=DEFAULT_DEVICE):
+    if device not in (None, "auto"):
+        return device
+    try:
+        torch = lazy_import("torch")
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda"
+    if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def resolve(device=DEFAULT_DEVICE, dtype=DEFAULT_DTYPE):
+    # -> (device, dtype name) actually used for a requested device and dtype
+    dtype = str(dtype).replace("torch.", "") if dtype is not None else None
+    if dtype == QUANTIZED_DTYPE:
+        if device not in (None, "auto", "cpu"):
+            logger.warning(f"{QUANTIZED_DTYPE} models only run on the cpu, ignoring device {device}")
+        return "cpu", dtype
+    device = resolve_device(device)
+    if dtype is None:
+        dtype = "float16" if device.startswith("cuda") else "float32"
+    return device, dtype
+
+
+def configure_threads(threads=CPU_THREADS):
+    torch = lazy_import("torch")
+    threads = threads or os.cpu_count() or 1
+    if torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+        logger.info(f"Using {threads} threads for cpu inference")
+
+
+def available_memory(device):
+    # Free bytes on the device that will hold the activations
+    if device.startswith("cuda"):
+        torch = lazy_import("torch")
+        return torch.cuda.mem_get_info(torch.device(device))[0]
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+
+
+def windows(audio_seconds):
+    # Number of chunk_length_s windows the pipeline cuts the audio into (strides overlap by a sixth per side)
+    length = DECODING_PARAMS["chunk_length_s"]
+    step = length - 2 * length / 6
+    return max(1, math.ceil(max(0.0, audio_seconds - length) / step) + 1)
+
+
+def batch_size_for(device, model_bytes, audio_seconds, batch_size=BATCH_SIZE):
+    # No more windows than the audio has, and only as many as fit in half the free memory
+    if batch_size:
+        return batch_size
+    limit = MAX_BATCH_SIZE.get(device.split(":")[0], 4)
+    try:
+        per_window = max(1, int(model_bytes * WINDOW_MEMORY_RATIO))
+        fits = int(available_memory(device) * 0.5 // per_window)
+    except Exception as e:
+        logger.warning(f"Could not read free memory on {device}: {str(e)}")
+        fits = 1
+    return max(1, min(limit, fits, windows(audio_seconds)))
+
+
+def _torch_dtype(dtype):
+    return getattr(lazy_import("torch"), dtype) if isinstance(dtype, str) else dtype
+
+
+def _model_size(model):
+    params = sum(p.numel() * p.element_size() for p in model.parameters())
+    buffers = sum(b.numel() * b.element_size() for b in model.buffers())
+    return params + buffers
+
+
+def _empty_device_cache(device):
+    if "torch" not in sys.modules:
+        return
+    torch = sys.modules["torch"]
+    if device.startswith("cuda") and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    elif device == "mps" and hasattr(torch, "mps") and torch.backends.mps.is_available():
+        torch.mps.empty_cache()
+
+
+class ASRModelRegistry:
+    # Process-wide cache of loaded ASR pipelines keyed by (model_id, language, device, dtype).
+    # Least recently used pipelines are evicted once the memory budget is exceeded.
+    def __init__(self, memory_budget_gb=DEFAULT_MEMORY_BUDGET_GB, loader=None):
+        self.memory_budget = int(memory_budget_gb * 1024 ** 3)
+        # loader(model_id, language, device, dtype) -> (pipeline, size in bytes); bench.py swaps in a stand-in
+        self.loader = loader or self._load
+        self.pipelines = OrderedDict()
+        self.lock = threading.Lock()
+        self.load_locks = {}
+
+    @staticmethod
+    def _key(model_id, language, device, dtype):
+        return (model_id, language, *resolve(device, dtype))
+
+    def _load(self, model_id, language, device, dtype):
+        transformers = lazy_import("transformers")
+        quantize = dtype == QUANTIZED_DTYPE
+        dtype = _torch_dtype("float32" if quantize else dtype)
+        if device == "cpu":
+            configure_threads()
+        model = transformers.AutoModelForSpeechSeq2Seq.from_pretrained(
+            model_id, torch_dtype=dtype, use_safetensors=True
+        )
+        model.to(device)
+        if quantize:
+            # Linear layers hold almost all of Whisper's weights; int8 roughly quarters their size
+            torch = lazy_import("torch")
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        processor = transformers.AutoProcessor.from_pretrained(model_id, language=language)
+
+        pipe = transformers.pipeline(
+            "automatic-speech-recognition",
+            model=model,
+            tokenizer=processor.tokenizer,
+            feature_extractor=processor.feature_extractor,
+            **DECODING_PARAMS,
+            torch_dtype=dtype,
+            device=device,
+        )
+        return pipe, _model_size(model)
+
+    def get(self, model_id, language="en", device=DEFAULT_DEVICE, dtype=DEFAULT_DTYPE):
+        key = self._key(model_id, language, device, dtype)
+        with self.lock:
+            if key in self.pipelines:
+                self.pipelines.move_to_end(key)
+                return self.pipelines[key][0]
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+        # Only one thread loads a given key; others wait for it and reuse the result
+        with load_lock:
+            with self.lock:
+                if key in self.pipelines:
+                    self.pipelines.move_to_end(key)
+                    return self.pipelines[key][0]
+            device, dtype = key[2], key[3]
+            logger.info(f"Loading ASR model {model_id} ({language}, {device}, {dtype})")
+            pipe, size = self.loader(model_id, language, device, dtype)
+            with self.lock:
+                self.pipelines[key] = (pipe, size)
+                self.load_locks.pop(key, None)
+                evicted = self._evict(keep=key)
+        for evicted_key in evicted:
+            logger.info(f"Evicted ASR model {evicted_key[0]} ({evicted_key[1]}, {evicted_key[2]})")
+            _empty_device_cache(evicted_key[2])
+        if evicted:
+            gc.collect()
+        return pipe
+
+    def _evict(self, keep):
+        evicted = []
+        while self.resident_bytes() > self.memory_budget and len(self.pipelines) > 1:
+            key = next(k for k in self.pipelines if k != keep)
+            del self.pipelines[key]
+            evicted.append(key)
+        return evicted
+
+    def warm_up(self, model_id, language="en", device=DEFAULT_DEVICE, dtype=DEFAULT_DTYPE, background=True):
+        if self.is_loaded(model_id, language, device, dtype):
+            return None
+        if not background:
+            self.get(model_id, language, device, dtype)
+            return None
+
+        def _warm():
+            try:
+                self.get(model_id, language, device, dtype)
+            except Exception as e:
+                logger.error(f"Failed to warm up ASR model {model_id}: {str(e)}")
+
+        thread = threading.Thread(target=_warm, daemon=True)
+        thread.start()
+        return thread
+
+    def is_loaded(self, model_id, language="en", device=DEFAULT_DEVICE, dtype=DEFAULT_DTYPE):
+        with self.lock:
+            return self._key(model_id, language, device, dtype) in self.pipelines
+
+    def unload(self, model_id=None):
+        # Unload every pipeline for model_id, or everything if model_id is None
+        with self.lock:
+            keys = [k for k in self.pipelines if model_id is None or k[0] == model_id]
+            for key in keys:
+                del self.pipelines[key]
+        for device in {k[2] for k in keys}:
+            _empty_device_cache(device)
+        gc.collect()
+        return len(keys)
+
+    def batch_size(self, model_id, language="en", audio_seconds=0.0, device=DEFAULT_DEVICE, dtype=DEFAULT_DTYPE):
+        key = self._key(model_id, language, device, dtype)
+        with self.lock:
+            size = self.pipelines[key][1] if key in self.pipelines else 0
+        return batch_size_for(key[2], size, audio_seconds)
+
+    def resident_bytes(self):
+        return sum(size for _, size in self.pipelines.values())
+
+    def loaded_models(self):
+        with self.lock:
+            return [{"model_id": k[0], "language": k[1], "device": k[2], "dtype": k[3], "bytes": size}
+                    for k, (_, size) in self.pipelines.items()]
+
+
+registry = ASRModelRegistry()
@@ -0,0 +1,340 @@
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+import zlib
+from time import perf_counter
+
+# End-to-end benchmark of TaskManager -> SummarizationTask -> pipeline with stand-in backends:
+# synthetic WAV files instead of YouTube, a fake ASR pipeline with a fixed real-time factor and a
+# fake Ollama server with fixed token rates. Results are written as JSON for comparing commits.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+VOCABULARY = ("market", "policy", "election", "release", "model", "launch", "report", "court", "league",
+              "climate", "budget", "senate", "company", "research", "season", "study", "price", "vote")
+
+
+def synth_transcript(words, seed=0):
+    rng = random.Random(seed)
+    sentences, count = [], 0
+    while count < words:
+        length = min(rng.randint(8, 20), words - count)
+        sentence = " ".join(rng.choice(VOCABULARY) for _ in range(length))
+        sentences.append(sentence.capitalize() + rng.choice(".?!"))
+        count += length
+    return " ".join(sentences)
+
+
+def synth_wav(path, seconds, sample_rate=16000, seed=0, speech=0.8):
+    # Bursts of tone separated by silence, written in one-second blocks; `speech` of them are tone
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(sample_rate) / sample_rate
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        for second in range(int(seconds)):
+            if rng.random() < speech:
+                block = 0.3 * np.sin(2 * np.pi * rng.uniform(120, 400) * t)
+            else:
+                block = np.zeros(sample_rate)
+            w.writeframes((block * 32767).astype("<i2").tobytes())
+
+
+class LocalAudioSource:
+    # Stands in for the YouTube download: serves a synthetic WAV of fixed length per video
+    def __init__(self, seconds, latency=0.0, speech=0.8):
+        self.seconds = seconds
+        self.latency = latency
+        self.speech = speech
+
+    def __call__(self, video_id):
+        time.sleep(self.latency)
+        path = f"audio/{video_id}.wav"
+        if not os.path.exists(path):
+            synth_wav(path, self.seconds, seed=zlib.crc32(video_id.encode()), speech=self.speech)
+        return path
+
+
+class FakeASRPipeline:
+    # Transcribes speed seconds of audio per wall second, emitting words_per_sec words of audio
+    def __init__(self, speed=50.0, words_per_sec=2.5):
+        self.speed = speed
+        self.words_per_sec = words_per_sec
+        self.lock = threading.Lock()  # One inference at a time, like a single accelerator
+
+    def __call__(self, inputs, **kwargs):
+        seconds = len(inputs["raw"]) / inputs["sampling_rate"]
+        with self.lock:
+            time.sleep(seconds / self.speed)
+        text = synth_transcript(int(seconds * self.words_per_sec), seed=zlib.crc32(inputs["raw"][:160000].tobytes()))
+        # One timestamped chunk per sentence, spread evenly over the audio like Whisper's
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", text) if s]
+        step = seconds / max(len(sentences), 1)
+        chunks = [{"timestamp": (round(i * step, 2), round((i + 1) * step, 2)), "text": f" {s}"} for i, s in enumerate(sentences)]
+        return {"text": text, "chunks": chunks}
+
+
+def fake_asr_loader(speed, load_time=0.0):
+    def _load(model_id, language, device, dtype):
+        time.sleep(load_time)
+        return FakeASRPipeline(speed), 0
+    return _load
+
+
+def install_fake_asr(speed, load_time=0.0):
+    # Worker process initializer: swap the fake ASR pipeline into that process's model registry
+    from asr import registry
+
+    registry.loader = fake_asr_loader(speed, load_time)
+
+
+def install_fake_node(audio_seconds, download_latency, speech, asr_speed, asr_load_time=0.0):
+    # Remote worker initializer (see bench_nodes): synthetic downloads and the fake ASR pipeline
+    import pipeline
+
+    pipeline.downloader = LocalAudioSource(audio_seconds, download_latency, speech)
+    install_fake_asr(asr_speed, asr_load_time)
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # RUSAGE_CHILDREN reports the largest child process reaped so far, e.g. a stage worker
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 1024 / 1024 if platform.system() == "Darwin" else rss / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {"mean": sum(values) / len(values), "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))], "max": values[-1]}
+
+
+def bench_pipeline(args):
+    import pipeline
+    from asr import registry
+    from manager import TaskManager
+    from task import STAGES, SummarizationTask
+
+    pipeline.downloader = LocalAudioSource(args.audio_seconds, args.download_latency, args.speech_fraction)
+    registry.loader = fake_asr_loader(args.asr_speed, args.asr_load_time)
+    workers = {stage: args.workers for stage in STAGES}
+    task_manager = TaskManager(workers=workers, queue_size=args.queue_size, processes=not args.in_process,
+                               initializer=("bench:install_fake_asr", [args.asr_speed, args.asr_load_time]))
+    tasks = [SummarizationTask(f"bench{i:04d}", f"Benchmark video {i}", sum_model_id="bench",
+                               chunk_size=args.chunk_size, overlap=args.overlap,
+                               on_status_change=task_manager.on_status_change,
+                               mode=args.mode, concurrency=args.concurrency)
+             for i in range(args.tasks)]
+    for task in tasks:
+        task_manager.add_task(task)
+    start = perf_counter()
+    task_manager.start_processing()
+    while task_manager.processing:
+        time.sleep(0.05)
+    elapsed = perf_counter() - start
+    task_manager.stop()
+    completed = [task for task in tasks if task.status == "Complete"]
+    return {
+        "tasks": len(tasks),
+        "completed": len(completed),
+        "wall_seconds": elapsed,
+        "tasks_per_hour": len(completed) / elapsed * 3600 if elapsed else 0.0,
+        "stage_seconds": {stage: _summary([t.timings[stage] for t in completed if stage in t.timings]) for stage in STAGES},
+        "errors": sorted({task.status for task in tasks if task.status != "Complete"}),
+    }
+
+
+def bench_nodes(args):
+    # The same workload drained by --nodes worker processes leasing jobs from a coordinator over HTTP
+    from coordinator import Coordinator
+    from jobqueue import JobQueue
+    from task import SummarizationTask
+
+    jobs = JobQueue()
+    coordinator = Coordinator(jobs, lease_seconds=args.lease_seconds).start(0, "127.0.0.1")
+    for i in range(args.tasks):
+        task = SummarizationTask(f"bench{i:04d}", f"Benchmark video {i}", sum_model_id="bench", chunk_size=args.chunk_size,
+                                 overlap=args.overlap, mode=args.mode, concurrency=args.concurrency)
+        jobs.submit(task.params(), duration=args.audio_seconds)
+    initializer = [args.audio_seconds, args.download_latency, args.speech_fraction, args.asr_speed, args.asr_load_time]
+    start = perf_counter()
+    nodes = [subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "cli.py"), "worker", "--coordinator", coordinator.url, "--name", f"node{n}",
+         "--workdir", f"node{n}", "--idle-exit", "2", "--initializer", "bench:install_fake_node",
+         "--initializer-args", json.dumps(initializer)] + (["--in-process"] if args.in_process else []),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    ) for n in range(args.nodes)]
+    while (jobs.count() or jobs.count("running")) and any(node.poll() is None for node in nodes):
+        time.sleep(0.05)
+    elapsed = perf_counter() - start
+    for node in nodes:
+        node.wait()
+    coordinator.stop()
+    completed = jobs.count("done")
+    return {
+        "tasks": args.tasks,
+        "nodes": args.nodes,
+        "completed": completed,
+        "wall_seconds": elapsed,
+        "tasks_per_hour": completed / elapsed * 3600 if elapsed else 0.0,
+        "errors": sorted(row[0] for row in jobs.connection().execute(
+            "SELECT DISTINCT error FROM jobs WHERE state != 'done' AND error IS NOT NULL")),
+    }
+
+
+def bench_chunker(sizes, chunk_size, overlap):
+    from chunking import chunker
+
+    results = []
+    for words in sizes:
+        transcript = synth_transcript(words)
+        start = perf_counter()
+        chunks = sum(1 for _ in chunker(transcript, chunk_size, overlap))
+        results.append({"words": words, "chars": len(transcript), "chunks": chunks, "seconds": perf_counter() - start})
+    return results
+
+
+def bench_summarize(sizes, modes, args):
+    import pipeline
+
+    results = []
+    for mode in modes:
+        for words in sizes:
+            transcript = synth_transcript(words, seed=words)
+            start = perf_counter()
+            pipeline.summarize(transcript, f"scale-{mode}-{words}", "bench", args.chunk_size, args.overlap,
+                               abstract=True, mode=mode, concurrency=args.concurrency)
+            results.append({"mode": mode, "words": words, "seconds": perf_counter() - start})
+    return results
+
+
+def bench_rtf(args):
+    # Real-time factor of the real ASR model for each device:dtype[:batch size] configuration
+    import asr
+    from asr import registry
+    from decode import SAMPLE_RATE, decode, load_pcm
+
+    source = args.rtf_audio or "audio/rtf.wav"
+    if not args.rtf_audio:
+        synth_wav(source, args.audio_seconds, seed=1)
+    decode("rtf", source)
+    audio = load_pcm("rtf")
+    seconds = len(audio) / SAMPLE_RATE
+    results = []
+    for config in args.rtf_configs.split(","):
+        device, dtype, batch = (config.split(":") + ["", ""])[:3]
+        try:
+            device, dtype = asr.resolve(device or "auto", dtype or None)
+            start = perf_counter()
+            pipe = registry.get(args.rtf_model, "en", device, dtype)
+            load_seconds = perf_counter() - start
+            batch_size = int(batch) if batch else registry.batch_size(args.rtf_model, "en", seconds, device, dtype)
+            start = perf_counter()
+            pipe({"raw": audio, "sampling_rate": SAMPLE_RATE}, batch_size=batch_size)
+            elapsed = perf_counter() - start
+        except Exception as e:
+            results.append({"config": config, "error": str(e)})
+            continue
+        finally:
+            registry.unload(args.rtf_model)
+        results.append({"config": config, "device": device, "dtype": dtype, "batch_size": batch_size,
+                        "audio_seconds": seconds, "load_seconds": load_seconds, "seconds": elapsed,
+                        "rtf": elapsed / seconds if seconds else None, "speed": seconds / elapsed if elapsed else None})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the summarization pipeline with stand-in backends")
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--audio-seconds", type=float, default=600, help="Length of each synthetic video")
+    parser.add_argument("--speech-fraction", type=float, default=0.8, help="Share of each synthetic video that is not silence")
+    parser.add_argument("--download-latency", type=float, default=0.2)
+    parser.add_argument("--asr-speed", type=float, default=60.0, help="Audio seconds transcribed per wall second")
+    parser.add_argument("--asr-load-time", type=float, default=2.0, help="Seconds to load the fake ASR model")
+    parser.add_argument("--tokens-per-sec", type=float, default=400.0, help="Fake Ollama generation rate")
+    parser.add_argument("--prompt-tokens-per-sec", type=float, default=4000.0, help="Fake Ollama prompt evaluation rate")
+    parser.add_argument("--response-words", type=int, default=100)
+    parser.add_argument("--mode", default="sequential", choices=("sequential", "map-reduce"))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=6000)
+    parser.add_argument("--overlap", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=1, help="Workers per stage")
+    parser.add_argument("--queue-size", type=int, default=2)
+    parser.add_argument("--in-process", action="store_true", help="Run every stage in threads instead of worker processes")
+    parser.add_argument("--nodes", type=int, default=0, help="Drain the queue with this many remote worker processes instead")
+    parser.add_argument("--lease-seconds", type=float, default=10.0, help="Job lease length with --nodes")
+    parser.add_argument("--scale-sizes", default="1000,5000,20000,50000", help="Transcript lengths in words for the scaling curves")
+    parser.add_argument("--skip-pipeline", action="store_true")
+    parser.add_argument("--skip-scaling", action="store_true")
+    parser.add_argument("--rtf", action="store_true", help="Only measure the real ASR model's real-time factor")
+    parser.add_argument("--rtf-model", default="openai/whisper-tiny")
+    parser.add_argument("--rtf-configs", default="auto,cpu:float32,cpu:int8",
+                        help="Comma separated device[:dtype[:batch size]] configurations; batch size defaults to adaptive")
+    parser.add_argument("--rtf-audio", default=None, help="Audio file for --rtf instead of synthetic audio")
+    parser.add_argument("--output", default=None, help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_DIR)
+    from fake_ollama import FakeOllama
+
+    output = os.path.abspath(args.output) if args.output else None
+    if args.rtf_audio:
+        args.rtf_audio = os.path.abspath(args.rtf_audio)
+    fake = FakeOllama(words=args.response_words, tokens_per_sec=args.tokens_per_sec,
+                      prompt_tokens_per_sec=args.prompt_tokens_per_sec).start()
+    os.environ["OLLAMA_HOST"] = fake.host
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "params": vars(args),
+    }
+    with tempfile.TemporaryDirectory(prefix="vsum-bench-") as workdir:
+        os.chdir(workdir)
+        for directory in ("audio", "transcripts", "summaries", "abstracts"):
+            os.makedirs(directory)
+        sizes = [int(s) for s in args.scale_sizes.split(",") if s]
+        if args.rtf:
+            results["rtf"] = bench_rtf(args)
+        if not args.skip_pipeline and not args.rtf:
+            results["pipeline"] = bench_nodes(args) if args.nodes else bench_pipeline(args)
+        if not args.skip_scaling and not args.rtf:
+            results["chunker"] = bench_chunker(sizes, args.chunk_size, args.overlap)
+            results["summarize"] = bench_summarize(sizes, ("sequential", "map-reduce"), args)
+        results["llm_requests"] = len(fake.requests)
+        results["peak_rss_mb"] = peak_rss_mb()
+        # Worker processes are reaped when the task manager (or node) stops, so they are included here
+        results["peak_worker_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+        os.chdir(REPO_DIR)
+    fake.stop()
+
+    text = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", "checkpoints")
+
+
+class Checkpoint:
+    # Progress of one long stage of one video, saved after every completed unit of work so a
+    # re-run resumes where the last one stopped. The key identifies the inputs and settings; a
+    # checkpoint saved under a different key is ignored.
+    def __init__(self, kind, video_id, key, directory=CHECKPOINT_DIR):
+        self.path = os.path.join(directory, f"{video_id}.{kind}.json")
+        self.key = key
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved.get("key") != self.key:
+            return None
+        return saved["state"]
+
+    def save(self, state):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"key": self.key, "state": state}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class CheckpointLog:
+    # Like Checkpoint, for progress that is a growing list: each completed unit is appended as one
+    # JSON line after a header line holding the key, so saving never rewrites earlier units. A line
+    # cut short by a crash is dropped on load.
+    def __init__(self, kind, video_id, key, directory=CHECKPOINT_DIR):
+        self.path = os.path.join(directory, f"{video_id}.{kind}.jsonl")
+        self.key = key
+        self.lock = threading.Lock()
+        self.started = False
+
+    def load(self):
+        # -> every unit saved under this key, in order
+        entries, good = [], 0
+        try:
+            with open(self.path, "rb") as f:
+                header = f.readline()
+                if not header.endswith(b"\n") or json.loads(header).get("key") != self.key:
+                    return []
+                good = f.tell()
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    entries.append(json.loads(line))
+                    good = f.tell()
+        except (OSError, ValueError):
+            if not good:
+                return []
+        # Drop anything after the last complete line, so the next append starts on a fresh line
+        with open(self.path, "r+b") as f:
+            f.truncate(good)
+        self.started = True
+        return entries
+
+    def append(self, entry):
+        with self.lock:
+            if not self.started:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "w") as f:
+                    f.write(json.dumps({"key": self.key}) + "\n")
+                self.started = True
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.started = False
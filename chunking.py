@@ -0,0 +1,159 @@
+import re
+
+from segments import format_time
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+WORD = re.compile(r'\S+\s*')
+
+
+class CharTokenizer:
+    # Counts characters, which keeps chunk sizes in the units the UI has always used
+    def count(self, text):
+        return len(text)
+
+
+class WordTokenizer:
+    def count(self, text):
+        return len(text.split())
+
+
+class HFTokenizer:
+    def __init__(self, model_id):
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+
+    def count(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+
+TOKENIZERS = {"chars": CharTokenizer, "words": WordTokenizer}
+_tokenizers = {}
+
+
+def get_tokenizer(name="chars"):
+    # "chars", "words", or any Hugging Face tokenizer id; anything with a count(text) method passes through
+    if not isinstance(name, str):
+        return name
+    if name not in _tokenizers:
+        _tokenizers[name] = TOKENIZERS[name]() if name in TOKENIZERS else HFTokenizer(name)
+    return _tokenizers[name]
+
+
+def _sentence_spans(text, max_tokens, tokenizer):
+    # Yield (start, end, tokens) for every sentence. Sentences longer than max_tokens, e.g. in
+    # unpunctuated transcripts, are split further at word boundaries.
+    start = 0
+    ends = [m.end() for m in SENTENCE_END.finditer(text)] + [len(text)]
+    for end in ends:
+        if end <= start:
+            continue
+        tokens = tokenizer.count(text[start:end])
+        if tokens <= max_tokens:
+            yield start, end, tokens
+        else:
+            yield from _word_spans(text, start, end, max_tokens, tokenizer)
+        start = end
+
+
+def _word_spans(text, start, end, max_tokens, tokenizer):
+    piece_start, piece_tokens = start, 0
+    for m in WORD.finditer(text, start, end):
+        tokens = tokenizer.count(m.group())
+        if tokens > max_tokens:
+            # A word too long for any chunk, e.g. a URL or text without spaces
+            if piece_tokens:
+                yield piece_start, m.start(), piece_tokens
+            yield from _hard_spans(text, m.start(), m.end(), max_tokens, tokenizer)
+            piece_start, piece_tokens = m.end(), 0
+            continue
+        if piece_tokens and piece_tokens + tokens > max_tokens:
+            yield piece_start, m.start(), piece_tokens
+            piece_start, piece_tokens = m.start(), 0
+        piece_tokens += tokens
+    if piece_start < end:
+        yield piece_start, end, piece_tokens
+
+
+def _hard_spans(text, start, end, max_tokens, tokenizer):
+    # Split text[start:end] anywhere, into the longest pieces of at most max_tokens (at least one character)
+    while start < end:
+        low, high = start + 1, end
+        while low < high:
+            middle = (low + high + 1) // 2
+            if tokenizer.count(text[start:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        yield start, low, tokenizer.count(text[start:low])
+        start = low
+
+
+def chunk_spans(transcript, chunk_size=6000, overlap=500, tokenizer="chars"):
+    # Yield (start, end) offsets of chunks of at most chunk_size tokens that end on sentence
+    # boundaries, each repeating up to `overlap` tokens of trailing sentences from the previous one
+    if overlap >= chunk_size:
+        raise ValueError(f"Overlap ({overlap}) must be smaller than the chunk size ({chunk_size})")
+    tokenizer = get_tokenizer(tokenizer)
+    spans = list(_sentence_spans(transcript, chunk_size, tokenizer))
+    i = 0
+    while i < len(spans):
+        j, total = i, 0
+        while j < len(spans) and (j == i or total + spans[j][2] <= chunk_size):
+            total += spans[j][2]
+            j += 1
+        yield spans[i][0], spans[j - 1][1]
+        if j >= len(spans):
+            break
+        # Only repeat as much as still leaves room for the next sentence, so every chunk moves on
+        k, back = j, 0
+        while k - 1 > i and back + spans[k - 1][2] <= min(overlap, chunk_size - spans[j][2]):
+            k -= 1
+            back += spans[k][2]
+        i = k
+
+
+# Generator function to split the transcript into chunks with overlapping content
+def chunker(transcript: str, chunk_size: int = 6000, overlap: int = 500, tokenizer="chars", segments=None, cite_every=60):
+    # Works on offsets into the transcript, so only the yielded chunks are ever copied. With a
+    # segments.SegmentStore for the transcript, chunks carry [mm:ss] times the summary can cite.
+    for start, end in chunk_spans(transcript, chunk_size, overlap, tokenizer):
+        if segments is None:
+            yield transcript[start:end]
+        else:
+            yield cite(transcript, start, end, segments, cite_every)
+
+
+def cite(transcript, start, end, segments, every=60):
+    # transcript[start:end] with the start time of its first segment, and of the first segment
+    # in every later `every` seconds, in front of that segment's text
+    pieces, position = [], start
+    index = segments.index_at_offset(start)
+    next_mark = None
+    while index < len(segments) and int(segments.chars[index]) < end:
+        seconds = float(segments.starts[index])
+        if next_mark is None or seconds >= next_mark:
+            at = max(int(segments.chars[index]), start)
+            pieces += [transcript[position:at], f"[{format_time(seconds)}] "]
+            position = at
+            next_mark = (seconds // every + 1) * every
+        index += 1
+    pieces.append(transcript[position:end])
+    return "".join(pieces)
+
+
+class ContextBudget:
+    # Keeps the context carried between sequential chunks under max_tokens. Once Ollama's context
+    # grows past it, the context is dropped and the tail of the summary so far is sent instead.
+    def __init__(self, max_tokens=4096, carry_chars=2000):
+        self.max_tokens = max_tokens
+        self.carry_chars = carry_chars
+
+    def apply(self, ctx, summary, chunk):
+        if not self.max_tokens or len(ctx) <= self.max_tokens:
+            return ctx, chunk
+        tail = summary[-self.carry_chars:]
+        cut = tail.find("\n")
+        if 0 <= cut < len(tail) - 1 and len(summary) > self.carry_chars:
+            tail = tail[cut + 1:]
+        prompt = f"Summary of the video so far, for context only. Do not repeat it:\n{tail}\n\nContinue with the next part of the transcript:\n{chunk}"
+        return [], prompt
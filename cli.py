@@ -0,0 +1,231 @@
+from time import perf_counter
+
+_started = perf_counter()
+
+import argparse
+import logging
+import sys
+import time
+
+from pipeline import SUMMARY_MODES
+from jobqueue import DEFAULT_POLICY, POLICIES, PRIORITIES, STAGES as JOB_STAGES
+from utils import IMPORT_TIMES
+
+logger = logging.getLogger("cli")
+
+
+def _report_imports():
+    lazy = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in IMPORT_TIMES.items()) or "none"
+    logger.info(f"Startup took {_startup:.2f} seconds; lazy imports: {lazy}")
+
+
+def _parse_workers(text):
+    # "download=2,transcribe=1" -> {"download": 2, "transcribe": 1}
+    workers = {}
+    for item in filter(None, (text or "").split(",")):
+        stage, _, count = item.partition("=")
+        workers[stage.strip()] = int(count)
+    return workers
+
+
+def _read_inputs(path):
+    stream = sys.stdin if path == "-" else open(path, "r")
+    with stream:
+        return "\n".join(line for line in stream if not line.startswith("#"))
+
+
+def _task(args, video_id, title, on_status_change=None):
+    from task import SummarizationTask
+
+    return SummarizationTask(video_id, title, args.language, args.model_id, args.sum_model_id, args.chunk_size,
+                             args.overlap, not args.no_abstract, on_status_change,
+                             mode=args.mode, concurrency=args.concurrency, tokenizer=args.tokenizer,
+                             context_budget=args.context_budget)
+
+
+def run(args):
+    from jobqueue import JobQueue
+    from manager import TaskManager
+    from metadata import get_resolver
+
+    inputs = _read_inputs(args.input)
+    task_manager = TaskManager(workers=_parse_workers(args.workers), queue_size=args.queue_size, processes=not args.in_process,
+                               jobs=JobQueue(policy=args.policy))
+    if args.metrics_port:
+        import metrics
+        metrics.start_http_server(args.metrics_port)
+    queued = {}
+
+    def enqueue(video_id, details):
+        details = details or {"title": video_id if args.no_titles else None, "duration": None}
+        task = _task(args, video_id, details["title"], task_manager.on_status_change)
+        queued[video_id] = task_manager.add_task(task, PRIORITIES[args.priority], details["duration"])
+
+    def update(video_id, details):
+        task_manager.set_details(queued[video_id], details["title"], details["duration"])
+
+    # Titles are looked up while the first tasks run; playlists and channels are listed before starting
+    get_resolver().ingest(inputs, enqueue, None if args.no_titles else update).wait(lookups=False)
+    tasks = list({id(task): task for task in queued.values()}.values())
+    logger.info(f"Queued {len(tasks)} tasks; jobs left over from earlier runs are resumed too")
+    start = time.time()
+    task_manager.start_processing()
+    try:
+        while task_manager.processing:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        # stop() marks the manager as shutting down first, so every in-flight job resumes on the next run
+        logger.info("Interrupted, stopping in-flight tasks; they resume on the next run")
+        task_manager.stop_processing()
+    task_manager.stop()
+    failed = [task for task in tasks if task.status != "Complete"]
+    logger.info(f"Finished {len(tasks) - len(failed)}/{len(tasks)} tasks in {time.time() - start:.2f} seconds")
+    for task in failed:
+        logger.error(f"{task.video_id}: {task.status}")
+    _report_imports()
+    return 1 if failed else 0
+
+
+def coordinate(args):
+    from coordinator import COORDINATOR_HOST, COORDINATOR_PORT, LEASE_SECONDS, Coordinator
+    from jobqueue import JobQueue
+    from metadata import get_resolver
+
+    jobs = JobQueue(policy=args.policy)
+    if args.metrics_port:
+        import metrics
+        metrics.start_http_server(args.metrics_port)
+    queued = {}
+    if args.input:
+        def enqueue(video_id, details):
+            details = details or {"title": video_id if args.no_titles else None, "duration": None}
+            job, _ = jobs.submit(_task(args, video_id, details["title"]).params(), PRIORITIES[args.priority], details["duration"])
+            queued[video_id] = job["id"]
+
+        def update(video_id, details):
+            jobs.set_details(queued[video_id], details["title"], details["duration"])
+
+        get_resolver().ingest(_read_inputs(args.input), enqueue, None if args.no_titles else update).wait(lookups=False)
+        logger.info(f"Queued {len(queued)} tasks")
+    coordinator = Coordinator(jobs, lease_seconds=args.lease_seconds or LEASE_SECONDS).start(args.port or COORDINATOR_PORT, args.host or COORDINATOR_HOST)
+    try:
+        while not (args.exit_when_done and not jobs.count() and not jobs.count("running")):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info("Interrupted, leased jobs are re-queued when their lease expires")
+    coordinator.stop()
+    failed = [job_id for job_id in queued.values() if jobs.get(job_id)["state"] != "done"]
+    for job_id in failed:
+        job = jobs.get(job_id)
+        logger.error(f"{job['video_id']}: {job['state']} {job['error'] or ''}")
+    return 1 if failed else 0
+
+
+def work(args):
+    import json
+    import os
+    from remote import RemoteWorker
+
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        os.chdir(args.workdir)
+    initializer = (args.initializer, json.loads(args.initializer_args)) if args.initializer else None
+    worker = RemoteWorker(args.coordinator, [c.strip() for c in args.capabilities.split(",") if c.strip()], args.name,
+                          processes=not args.in_process, initializer=initializer)
+    try:
+        jobs = worker.run(idle_exit=args.idle_exit)
+    except KeyboardInterrupt:
+        logger.info("Interrupted, the coordinator re-queues the current job when its lease expires")
+        return 1
+    logger.info(f"Worker {worker.name} finished {jobs} jobs")
+    return 0
+
+
+def search(args):
+    from search import get_search_index, plain
+
+    for result in get_search_index().search(args.query, args.limit):
+        print(f"{result['video_id']}  {result['title']}  ({result['kind']})\n    {plain(result['snippet'])}")
+    return 0
+
+
+def reindex(args):
+    from search import get_search_index
+
+    print(f"Indexed {get_search_index().rebuild()} documents")
+    return 0
+
+
+def _add_task_options(parser):
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--model-id", default="openai/whisper-large-v3", help="Whisper model")
+    parser.add_argument("--sum-model-id", default="llama3", help="Ollama model")
+    parser.add_argument("--chunk-size", type=int, default=6000)
+    parser.add_argument("--overlap", type=int, default=500)
+    parser.add_argument("--no-abstract", action="store_true")
+    parser.add_argument("--mode", default=SUMMARY_MODES[0], choices=SUMMARY_MODES)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--tokenizer", default="chars")
+    parser.add_argument("--context-budget", type=int, default=4096)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="cli", description="Summarize YouTube videos without the web UI")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Summarize every video listed in a file")
+    run_parser.add_argument("--input", required=True, help="File with video IDs, video, playlist or channel URLs, one per line, or - for stdin")
+    _add_task_options(run_parser)
+    run_parser.add_argument("--workers", default="", help="Workers per stage, e.g. download=2,transcribe=1")
+    run_parser.add_argument("--queue-size", type=int, default=2, help="Bounded queue size between stages")
+    run_parser.add_argument("--no-titles", action="store_true", help="Skip looking up video titles")
+    run_parser.add_argument("--priority", default="Normal", choices=list(PRIORITIES))
+    run_parser.add_argument("--policy", default=DEFAULT_POLICY, choices=POLICIES, help="Order of pending jobs within a priority")
+    run_parser.add_argument("--in-process", action="store_true", help="Transcribe and summarize in threads instead of worker processes")
+    run_parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port while running")
+    run_parser.set_defaults(func=run)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="Serve the job queue to workers on other machines")
+    coordinator_parser.add_argument("--input", default=None, help="File of videos to queue first, as for run, or - for stdin")
+    _add_task_options(coordinator_parser)
+    coordinator_parser.add_argument("--no-titles", action="store_true", help="Skip looking up video titles")
+    coordinator_parser.add_argument("--priority", default="Normal", choices=list(PRIORITIES))
+    coordinator_parser.add_argument("--policy", default=DEFAULT_POLICY, choices=POLICIES, help="Order of pending jobs within a priority")
+    coordinator_parser.add_argument("--host", default=None,
+                                    help="Address to serve on (default $COORDINATOR_HOST or 127.0.0.1); other hosts need COORDINATOR_TOKEN")
+    coordinator_parser.add_argument("--port", type=int, default=None, help="Port to serve on (default $COORDINATOR_PORT or 8765)")
+    coordinator_parser.add_argument("--lease-seconds", type=float, default=None,
+                                    help="Seconds a job stays leased without a heartbeat (default $COORDINATOR_LEASE_SECONDS or 60)")
+    coordinator_parser.add_argument("--exit-when-done", action="store_true", help="Stop once no job is pending or running")
+    coordinator_parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port while running")
+    coordinator_parser.set_defaults(func=coordinate)
+
+    worker_parser = subparsers.add_parser("worker", help="Run jobs leased from a coordinator")
+    worker_parser.add_argument("--coordinator", required=True, help="Coordinator URL, e.g. http://host:8765")
+    worker_parser.add_argument("--capabilities", default=",".join(JOB_STAGES), help="Stages to run: asr, llm or both")
+    worker_parser.add_argument("--name", default=None, help="Worker name shown by the coordinator (default host-pid)")
+    worker_parser.add_argument("--workdir", default=None, help="Directory for audio and artifacts (default the current one)")
+    worker_parser.add_argument("--in-process", action="store_true", help="Transcribe and summarize in threads instead of worker processes")
+    worker_parser.add_argument("--idle-exit", type=float, default=None, help="Exit after this many seconds without a job")
+    worker_parser.add_argument("--initializer", default=None, help="module:function run before the first job, e.g. to install test backends")
+    worker_parser.add_argument("--initializer-args", default="[]", help="JSON list of arguments for --initializer")
+    worker_parser.set_defaults(func=work)
+
+    search_parser = subparsers.add_parser("search", help="Full-text search over the library")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--limit", type=int, default=10)
+    search_parser.set_defaults(func=search)
+
+    reindex_parser = subparsers.add_parser("reindex", help="Rebuild the full-text index from files on disk")
+    reindex_parser.set_defaults(func=reindex)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger("task").propagate = False  # task.py already logs to the console itself
+    return args.func(args)
+
+
+_startup = perf_counter() - _started
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+import hmac
+import ipaddress
+import json
+import os
+import re
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+
+import metrics
+from artifacts import artifact_path
+from jobqueue import STAGES
+from pipeline import write_artifact
+from search import get_search_index
+from segments import segments_path
+from store import get_store
+
+logger = getLogger(__name__)
+
+# Serves the job queue to workers on other machines (see remote.py). A worker leases a job for a
+# stage it can run, renews the lease while it works, uploads the stage's artifacts and completes it.
+# Jobs whose lease runs out are handed to the next worker.
+# Set COORDINATOR=1 to serve the web app's queue to remote workers as well
+ENABLED = os.environ.get("COORDINATOR", "0") == "1"
+COORDINATOR_PORT = int(os.environ.get("COORDINATOR_PORT", "8765"))
+# Only local workers can connect by default; serving other hosts (e.g. 0.0.0.0) requires a token
+COORDINATOR_HOST = os.environ.get("COORDINATOR_HOST", "127.0.0.1")
+# Shared secret workers send as "Authorization: Bearer <token>"; unset accepts any local request
+TOKEN = os.environ.get("COORDINATOR_TOKEN") or None
+LEASE_SECONDS = float(os.environ.get("COORDINATOR_LEASE_SECONDS", "60"))
+UPLOAD_DIR = os.environ.get("COORDINATOR_UPLOAD_DIR", "uploads")
+MAX_UPLOAD_BYTES = int(os.environ.get("COORDINATOR_MAX_UPLOAD_MB", "512")) * 1024 * 1024
+
+# What a worker uploads when it finishes each stage; the first kind is required
+UPLOADS = {"asr": ("transcript", "segments"), "llm": ("summary", "abstract")}
+# What a worker may download to run each stage
+DOWNLOADS = {"llm": ("transcript", "segments")}
+
+
+def artifact_file(video_id, kind):
+    return segments_path(video_id) if kind == "segments" else artifact_path(video_id, kind)
+
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class Coordinator:
+    def __init__(self, jobs, lease_seconds=LEASE_SECONDS, upload_dir=UPLOAD_DIR, on_change=None):
+        self.jobs = jobs
+        self.lease_seconds = lease_seconds
+        self.upload_dir = upload_dir
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.statuses = {}  # job id -> latest status reported by its worker
+        self.server = None
+        self.stop_event = threading.Event()
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def _held(self, job_id, worker):
+        job = self.jobs.get(job_id)
+        if job is None or job["state"] != "running" or job["worker"] != worker:
+            raise LeaseLost(f"Job {job_id} is not leased to {worker}")
+        return job
+
+    def _staged(self, job_id, kind):
+        return os.path.join(self.upload_dir, str(job_id), kind)
+
+    def lease(self, worker, capabilities):
+        # -> {"id", "stage", "params", "lease_seconds"} of the next job worker can run, or None
+        stages = [stage for stage in STAGES if stage in capabilities]
+        if not stages:
+            return None
+        job = self.jobs.claim(stages, worker, self.lease_seconds)
+        if job is None:
+            return None
+        shutil.rmtree(os.path.join(self.upload_dir, str(job["id"])), ignore_errors=True)
+        with self.lock:
+            self.statuses[job["id"]] = f"Leased by {worker}"
+        logger.info(f"Leased job {job['id']} ({job['video_id']}, {job['stage']}) to {worker}")
+        self._changed()
+        return {"id": job["id"], "stage": job["stage"], "params": job["params"], "lease_seconds": self.lease_seconds}
+
+    def heartbeat(self, job_id, worker, status=None):
+        if not self.jobs.heartbeat(job_id, worker, self.lease_seconds):
+            raise LeaseLost(f"Job {job_id} is not leased to {worker}")
+        if status:
+            with self.lock:
+                self.statuses[job_id] = status
+            self._changed()
+
+    def upload(self, job_id, worker, kind, data):
+        job = self._held(job_id, worker)
+        if kind not in UPLOADS[job["stage"]]:
+            raise ValueError(f"Stage {job['stage']} does not produce {kind}")
+        path = self._staged(job_id, kind)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def download(self, job_id, worker, kind):
+        # -> bytes of an artifact the leased stage needs, or None if there is none
+        job = self._held(job_id, worker)
+        if kind not in DOWNLOADS.get(job["stage"], ()):
+            raise ValueError(f"Stage {job['stage']} does not use {kind}")
+        try:
+            with open(artifact_file(job["video_id"], kind), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def complete(self, job_id, worker):
+        # Move the uploaded artifacts into place, then pass the job on to its next stage or finish it
+        job = self._held(job_id, worker)
+        video_id, kinds = job["video_id"], UPLOADS[job["stage"]]
+        if not os.path.exists(self._staged(job_id, kinds[0])):
+            raise ValueError(f"Upload {kinds[0]} before completing stage {job['stage']}")
+        uploaded = [kind for kind in kinds if os.path.exists(self._staged(job_id, kind))]
+        for kind in uploaded:
+            if kind == "segments":
+                os.replace(self._staged(job_id, kind), segments_path(video_id))
+            else:
+                with open(self._staged(job_id, kind), "r", encoding="utf-8") as f:
+                    write_artifact(video_id, kind, f.read())
+        shutil.rmtree(os.path.join(self.upload_dir, str(job_id)), ignore_errors=True)
+        next_stages = STAGES[STAGES.index(job["stage"]) + 1:]
+        if next_stages:
+            done = self.jobs.advance(job_id, next_stages[0], worker)
+        else:
+            done = self.jobs.complete(job_id, worker)
+            if done:
+                self._add_to_library(job, "abstract" in uploaded)
+                metrics.tasks_finished.inc(outcome="complete")
+        if not done:
+            raise LeaseLost(f"Job {job_id} is not leased to {worker}")
+        with self.lock:
+            self.statuses.pop(job_id, None)
+        logger.info(f"{worker} finished {job['stage']} of job {job_id} ({video_id})")
+        self._changed()
+
+    def _add_to_library(self, job, has_abstract):
+        params, video_id = job["params"], job["video_id"]
+        get_store().add_video(
+            video_id, params.get("title"), params.get("language"),
+            transcript=artifact_file(video_id, "transcript"),
+            summary=artifact_file(video_id, "summary"),
+            abstract=artifact_file(video_id, "abstract") if has_abstract else None,
+        )
+        try:
+            get_search_index().index(video_id, "title", params.get("title"))
+        except Exception as e:
+            logger.warning(f"Failed to index title of {video_id}: {str(e)}")
+
+    def fail(self, job_id, worker, error):
+        # -> True if the job will be retried
+        retry = self.jobs.fail(job_id, error, worker)
+        if retry is None:
+            raise LeaseLost(f"Job {job_id} is not leased to {worker}")
+        with self.lock:
+            self.statuses.pop(job_id, None)
+        logger.warning(f"{worker} failed job {job_id}: {error}")
+        metrics.tasks_finished.inc(outcome="retried" if retry else "error")
+        self._changed()
+        return retry
+
+    def expire(self):
+        expired = self.jobs.expire()
+        if expired:
+            with self.lock:
+                running = {job["id"] for job in self.jobs.leased()}
+                self.statuses = {job_id: status for job_id, status in self.statuses.items() if job_id in running}
+            self._changed()
+        return expired
+
+    def active(self):
+        # Jobs leased right now, with the worker holding each and its latest status
+        with self.lock:
+            statuses = dict(self.statuses)
+        return [{"id": job["id"], "video_id": job["video_id"], "title": job["title"], "language": job["params"]["language"],
+                 "stage": job["stage"], "worker": job["worker"], "status": statuses.get(job["id"], "")}
+                for job in self.jobs.leased()]
+
+    def _expire_loop(self):
+        while not self.stop_event.wait(max(1.0, self.lease_seconds / 4)):
+            try:
+                self.expire()
+            except Exception as e:
+                logger.warning(f"Failed to expire leases: {str(e)}")
+
+    def start(self, port=COORDINATOR_PORT, host=COORDINATOR_HOST):
+        if TOKEN is None and not _is_loopback(host):
+            raise ValueError(f"Set COORDINATOR_TOKEN before serving workers on {host}")
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._expire_loop, daemon=True).start()
+        logger.info(f"Coordinating workers on http://{host}:{self.server.server_address[1]}")
+        return self
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{'127.0.0.1' if host == '0.0.0.0' else host}:{port}"
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+ROUTE = re.compile(r"^/jobs/(?:(lease)|(\d+)/(heartbeat|complete|fail)|(\d+)/artifacts/(\w+))$")
+
+
+def _handler(coordinator):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, payload, status=200):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_UPLOAD_BYTES:
+                raise ValueError(f"Body larger than {MAX_UPLOAD_BYTES} bytes")
+            return self.rfile.read(length)
+
+        def _authorized(self):
+            if TOKEN is None:
+                return True
+            return hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {TOKEN}")
+
+        def _dispatch(self, method):
+            match = ROUTE.match(self.path.split("?")[0])
+            if not self._authorized():
+                return self._send({"error": "unauthorized"}, 401)
+            if match is None:
+                return self._send({"error": "not found"}, 404)
+            lease, job_id, action, artifact_job, kind = match.groups()
+            worker = self.headers.get("X-Worker", "")
+            try:
+                body = json.loads(self._read() or b"{}") if method == "POST" else {}
+                worker = body.get("worker") or worker
+                if not worker:
+                    return self._send({"error": "no worker name"}, 400)
+                if artifact_job and method == "PUT":
+                    coordinator.upload(int(artifact_job), worker, kind, self._read())
+                    return self._send({"ok": True})
+                if artifact_job and method == "GET":
+                    data = coordinator.download(int(artifact_job), worker, kind)
+                    if data is None:
+                        return self._send({"error": f"no {kind}"}, 404)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    return self.wfile.write(data)
+                if method != "POST":
+                    return self._send({"error": "method not allowed"}, 405)
+                if lease:
+                    job = coordinator.lease(worker, body.get("capabilities") or [])
+                    return self._send({"job": job})
+                job_id = int(job_id)
+                if action == "heartbeat":
+                    coordinator.heartbeat(job_id, worker, body.get("status"))
+                    return self._send({"ok": True, "lease_seconds": coordinator.lease_seconds})
+                if action == "complete":
+                    coordinator.complete(job_id, worker)
+                    return self._send({"ok": True})
+                retry = coordinator.fail(job_id, worker, str(body.get("error") or "failed"))
+                return self._send({"ok": True, "retry": retry})
+            except LeaseLost as e:
+                return self._send({"error": str(e)}, 409)
+            except (ValueError, KeyError) as e:
+                return self._send({"error": str(e)}, 400)
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_PUT(self):
+            self._dispatch("PUT")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+    return Handler
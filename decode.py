@@ -0,0 +1,73 @@
+import glob
+import os
+import subprocess
+import wave
+from logging import getLogger
+
+from utils import lazy_import
+
+logger = getLogger(__name__)
+
+SAMPLE_RATE = 16000
+PCM_EXT = ".f32"
+
+
+def pcm_path(video_id):
+    return f"audio/{video_id}{PCM_EXT}"
+
+
+def find_source(video_id):
+    # Whatever yt_dlp downloaded for this video, in its original container and codec
+    sources = [p for p in glob.glob(f"audio/{glob.escape(video_id)}.*") if not p.endswith((PCM_EXT, ".part", ".tmp"))]
+    if not sources:
+        raise FileNotFoundError(f"No downloaded audio for video {video_id}")
+    return max(sources, key=os.path.getmtime)
+
+
+def decode(video_id, source=None):
+    # Decode the source once into raw 16 kHz mono float32 samples, which every ASR run then
+    # memory-maps instead of decoding the compressed audio again
+    source = source or find_source(video_id)
+    target = pcm_path(video_id)
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+        return target
+    tmp = f"{target}.tmp"
+    if source.endswith(".wav") and _decode_wav(source, tmp):
+        os.replace(tmp, target)
+        return target
+    cmd = ["ffmpeg", "-nostdin", "-v", "error", "-y", "-i", source,
+           "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "-acodec", "pcm_f32le", tmp]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise Exception(f"Failed to decode audio: {result.stderr.decode(errors='replace').strip()}")
+    os.replace(tmp, target)
+    return target
+
+
+def _decode_wav(source, target):
+    # 16 kHz mono 16-bit WAV needs no resampling, so convert it in-process without ffmpeg
+    np = lazy_import("numpy")
+    with wave.open(source, "rb") as w:
+        if (w.getframerate(), w.getnchannels(), w.getsampwidth()) != (SAMPLE_RATE, 1, 2):
+            return False
+        with open(target, "wb") as out:
+            while True:
+                frames = w.readframes(SAMPLE_RATE * 60)
+                if not frames:
+                    break
+                (np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768.0).tofile(out)
+    return True
+
+
+def load_pcm(video_id):
+    np = lazy_import("numpy")
+    path = pcm_path(video_id)
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r")
+
+
+def duration(video_id):
+    return os.path.getsize(pcm_path(video_id)) / 4 / SAMPLE_RATE
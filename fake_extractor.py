@@ -0,0 +1,42 @@
+import random
+import re
+import threading
+import time
+
+# A stand-in for yt_dlp's metadata extraction, for bulk-adding videos without network access.
+# Titles and durations are derived from the video id, so every run sees the same metadata.
+
+
+class FakeExtractor:
+    def __init__(self, latency=0.0, playlist_size=10, fail=()):
+        # Every lookup takes latency seconds; listings return playlist_size videos; ids in fail raise
+        self.latency = latency
+        self.playlist_size = playlist_size
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+        self.lookups = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _request(self, target):
+        with self.lock:
+            self.lookups.append(target)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def video(self, video_id):
+        self._request(video_id)
+        if video_id in self.fail:
+            raise Exception(f"Video unavailable: {video_id}")
+        return {"title": f"Video {video_id}", "duration": random.Random(video_id).randint(60, 3600)}
+
+    def listing(self, url):
+        # Flat listings have titles but, like many real ones, no durations
+        self._request(url)
+        prefix = [part for part in re.split(r"[/?=]", url) if part and part != "videos"][-1]
+        return [{"video_id": f"{prefix}-{i}", "title": f"Video {prefix}-{i}", "duration": None} for i in range(self.playlist_size)]
@@ -0,0 +1,154 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A stand-in for the Ollama HTTP API, good enough to drive pipeline.summarize without a GPU.
+# Responses are canned text generated at a fixed rate, and every request is recorded.
+
+
+class FakeOllama:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, words=20, tokens_per_sec=None, prompt_tokens_per_sec=None):
+        # Each generate call takes latency seconds, plus prompt and response tokens at the given rates
+        self.latency = latency
+        self.words = words
+        self.tokens_per_sec = tokens_per_sec
+        self.prompt_tokens_per_sec = prompt_tokens_per_sec
+        self.models = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def host(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def generate(self, body):
+        # Yields the response parts: one per word when streaming, otherwise a single final part
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.requests.append(body)
+        try:
+            stream = body.get("stream", True)
+            prompt = body.get("prompt", "")
+            prompt_tokens = len(prompt.split()) + len(body.get("context") or [])
+            prompt_time = prompt_tokens / self.prompt_tokens_per_sec if self.prompt_tokens_per_sec else 0.0
+            eval_time = self.words / self.tokens_per_sec if self.tokens_per_sec else 0.0
+            words = [f"w{i}" for i in range(self.words)]
+            if stream:
+                time.sleep(self.latency + prompt_time)
+                for i, word in enumerate(words):
+                    time.sleep(eval_time / max(self.words, 1))
+                    yield {"model": body.get("model"), "response": word if i == 0 else f" {word}", "done": False}
+            else:
+                time.sleep(self.latency + prompt_time + eval_time)
+            context = list(body.get("context") or []) + list(range(len(prompt.split()) + self.words))
+            yield {
+                "model": body.get("model"),
+                "response": "\n" if stream else " ".join(words) + "\n",
+                "done": True,
+                "context": context,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_time * 1e9),
+                "eval_count": self.words,
+                "eval_duration": int((self.latency + eval_time) * 1e9),
+            }
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _send(self, payload, status=200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send({"models": [{"name": name, **info} for name, info in fake.models.items()]})
+                else:
+                    self._send({"error": "not found"}, 404)
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.end_headers()
+
+            def do_POST(self):
+                body = self._body()
+                if self.path == "/api/generate" and body.get("stream", True):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.end_headers()
+                    for part in fake.generate(body):
+                        self.wfile.write(json.dumps(part).encode() + b"\n")
+                        self.wfile.flush()
+                elif self.path == "/api/generate":
+                    self._send(list(fake.generate(body))[-1])
+                elif self.path == "/api/create":
+                    with fake.lock:
+                        fake.models[body["name"]] = {"modelfile": body.get("modelfile", "")}
+                    self._send({"status": "success"})
+                elif self.path == "/api/show":
+                    if body.get("name") in fake.models:
+                        self._send(fake.models[body["name"]])
+                    else:
+                        self._send({"error": "model not found"}, 404)
+                else:
+                    self._send({"error": "not found"}, 404)
+
+            def do_DELETE(self):
+                body = self._body()
+                with fake.lock:
+                    found = fake.models.pop(body.get("name"), None) is not None
+                self._send({} if found else {"error": "model not found"}, 200 if found else 404)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per generate call")
+    parser.add_argument("--words", type=int, default=20, help="Words per response")
+    parser.add_argument("--tokens-per-sec", type=float, default=None, help="Response generation rate")
+    parser.add_argument("--prompt-tokens-per-sec", type=float, default=None, help="Prompt evaluation rate")
+    args = parser.parse_args()
+    server = FakeOllama(port=args.port, latency=args.latency, words=args.words,
+                        tokens_per_sec=args.tokens_per_sec, prompt_tokens_per_sec=args.prompt_tokens_per_sec)
+    print(f"Fake Ollama listening on {server.host}")
+    server.server.serve_forever()
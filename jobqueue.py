@@ -0,0 +1,275 @@
+import json
+import os
+import sqlite3
+import threading
+from logging import getLogger
+from time import time as ttime
+
+from resultcache import cache_key
+from store import DB_PATH
+
+logger = getLogger(__name__)
+
+PRIORITIES = {"Low": -1, "Normal": 0, "High": 1}
+# A job starts at "asr" (audio to transcript) and moves to "llm" (transcript to summary) when a
+# remote worker finishes the first half; see coordinator.py. Local TaskManagers run whole jobs,
+# so they only claim jobs that have not started.
+STAGES = ("asr", "llm")
+POLICIES = ("priority", "shortest-first")
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+# "shortest-first" runs shorter videos first within a priority level
+DEFAULT_POLICY = os.environ.get("JOB_POLICY", "priority")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    title TEXT,
+    params TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    duration REAL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    stage TEXT NOT NULL DEFAULT 'asr',
+    worker TEXT,
+    lease_expires REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs(job_key) WHERE state IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs(priority DESC, id) WHERE state = 'pending';
+CREATE INDEX IF NOT EXISTS jobs_shortest ON jobs(priority DESC, COALESCE(duration, 1e18), id) WHERE state = 'pending';
+CREATE INDEX IF NOT EXISTS jobs_video ON jobs(video_id, state);
+"""
+
+# Columns added after the first release, for queues created before them
+MIGRATIONS = {
+    "stage": "ALTER TABLE jobs ADD COLUMN stage TEXT NOT NULL DEFAULT 'asr'",
+    "worker": "ALTER TABLE jobs ADD COLUMN worker TEXT",
+    "lease_expires": "ALTER TABLE jobs ADD COLUMN lease_expires REAL",
+}
+
+LEASE_SCHEMA = """
+CREATE INDEX IF NOT EXISTS jobs_stage_queue ON jobs(stage, priority DESC, id) WHERE state = 'pending';
+CREATE INDEX IF NOT EXISTS jobs_stage_shortest ON jobs(stage, priority DESC, COALESCE(duration, 1e18), id) WHERE state = 'pending';
+CREATE INDEX IF NOT EXISTS jobs_leases ON jobs(lease_expires) WHERE state = 'running';
+"""
+
+# Unknown durations sort after every known one
+ORDER_BY = {
+    "priority": "priority DESC, id",
+    "shortest-first": "priority DESC, COALESCE(duration, 1e18), id",
+}
+
+
+def job_key(params):
+    # Identical video and settings make an identical job, whatever the title says
+    return cache_key("job", {k: v for k, v in params.items() if k != "title"})
+
+
+class JobQueue:
+    # Durable queue of summarization jobs: pending -> running -> done | failed | cancelled.
+    # Every operation touches one row through an index, so adding, claiming, removing and
+    # reprioritizing stay cheap however long the backlog gets. Same connection handling as store.py.
+    def __init__(self, path=DB_PATH, policy=DEFAULT_POLICY, max_attempts=MAX_ATTEMPTS):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.path = path
+        self.policy = policy
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+            conn.executescript(LEASE_SCHEMA)
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _row(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        return job
+
+    def submit(self, params, priority=0, duration=None):
+        # -> (job, created). A job identical to one still pending or running is not added again;
+        # the existing one is returned, at the higher of the two priorities.
+        key = job_key(params)
+        now = ttime()
+        conn = self.connection()
+        with conn:
+            # Take the write lock before looking, so identical jobs submitted at once are merged
+            conn.execute("BEGIN IMMEDIATE")
+            existing = conn.execute(
+                "SELECT * FROM jobs WHERE job_key = ? AND state IN ('pending', 'running')", (key,)
+            ).fetchone()
+            if existing is not None:
+                if priority > existing["priority"]:
+                    conn.execute("UPDATE jobs SET priority = ?, updated_at = ? WHERE id = ?", (priority, now, existing["id"]))
+                return self.get(existing["id"]), False
+            cursor = conn.execute(
+                "INSERT INTO jobs (job_key, video_id, title, params, priority, duration, max_attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, params["video_id"], params.get("title"), json.dumps(params), priority, duration, self.max_attempts, now, now),
+            )
+        return self.get(cursor.lastrowid), True
+
+    def get(self, job_id):
+        return self._row(self.connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def peek(self, stages=("asr",)):
+        return self._row(self.connection().execute(
+            f"SELECT * FROM jobs WHERE state = 'pending' AND stage IN ({', '.join('?' * len(stages))}) "
+            f"ORDER BY {ORDER_BY[self.policy]} LIMIT 1", tuple(stages)
+        ).fetchone())
+
+    def claim(self, stages=("asr",), worker=None, lease_seconds=None):
+        # Mark the next pending job in one of stages running and return it, or None if nothing is
+        # pending. A remote worker's claim is a lease that expires unless renewed with heartbeat().
+        conn = self.connection()
+        while True:
+            job = self.peek(stages)
+            if job is None:
+                return None
+            now = ttime()
+            with conn:
+                cursor = conn.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, worker = ?, lease_expires = ?, updated_at = ? "
+                    "WHERE id = ? AND state = 'pending'",
+                    (worker, now + lease_seconds if lease_seconds else None, now, job["id"]),
+                )
+            if cursor.rowcount:  # Otherwise another worker got there first
+                return self.get(job["id"])
+
+    def heartbeat(self, job_id, worker, lease_seconds):
+        # Renew a lease; False if the worker no longer holds it
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (ttime() + lease_seconds, ttime(), job_id, worker),
+            )
+        return cursor.rowcount > 0
+
+    def expire(self):
+        # Jobs whose workers stopped renewing their lease go back to pending, or fail once out of attempts
+        now = ttime()
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END, "
+                "error = 'lease expired on ' || worker, worker = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE state = 'running' AND lease_expires < ?",
+                (now, now),
+            )
+        if cursor.rowcount:
+            logger.warning(f"Re-queued {cursor.rowcount} jobs whose lease expired")
+        return cursor.rowcount
+
+    def advance(self, job_id, stage, worker):
+        # Hand a job on to its next stage, with a fresh set of attempts
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET stage = ?, state = 'pending', attempts = 0, error = NULL, worker = NULL, lease_expires = NULL, "
+                "updated_at = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (stage, ttime(), job_id, worker),
+            )
+        return cursor.rowcount > 0
+
+    def _set_state(self, job_id, state, error=None, where="1", params=()):
+        with self.connection() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET state = ?, error = ?, worker = NULL, lease_expires = NULL, updated_at = ? WHERE id = ? AND {where}",
+                (state, error, ttime(), job_id, *params),
+            )
+        return cursor.rowcount > 0
+
+    def _held(self, worker):
+        # Only running jobs can be finished, and a remote worker's only while it holds the lease
+        return ("worker = ? AND state = 'running'", (worker,)) if worker is not None else ("state = 'running'", ())
+
+    def complete(self, job_id, worker=None):
+        return self._set_state(job_id, "done", None, *self._held(worker))
+
+    def fail(self, job_id, error, worker=None):
+        # -> True if the job was put back for another attempt, None if it is no longer running (for worker)
+        job = self.get(job_id)
+        state = "pending" if job is not None and job["attempts"] < job["max_attempts"] else "failed"
+        if not self._set_state(job_id, state, error, *self._held(worker)):
+            return None
+        return state == "pending"
+
+    def cancel(self, job_id):
+        return self._set_state(job_id, "cancelled", where="state IN ('pending', 'running')")
+
+    def release(self, job_id):
+        # Put a running job back without counting the attempt, e.g. when shutting down
+        with self.connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'pending', attempts = MAX(attempts - 1, 0), updated_at = ? WHERE id = ? AND state = 'running'",
+                (ttime(), job_id),
+            )
+
+    def remove(self, video_id):
+        # Cancel every pending job for video_id and return their ids
+        conn = self.connection()
+        with conn:
+            ids = [row[0] for row in conn.execute("SELECT id FROM jobs WHERE video_id = ? AND state = 'pending'", (video_id,))]
+            conn.executemany("UPDATE jobs SET state = 'cancelled', updated_at = ? WHERE id = ? AND state = 'pending'",
+                             [(ttime(), job_id) for job_id in ids])
+        return ids
+
+    def pending_for(self, video_id):
+        rows = self.connection().execute("SELECT * FROM jobs WHERE video_id = ? AND state = 'pending'", (video_id,)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def set_priority(self, job_id, priority):
+        with self.connection() as conn:
+            conn.execute("UPDATE jobs SET priority = ?, updated_at = ? WHERE id = ?", (priority, ttime(), job_id))
+
+    def set_details(self, job_id, title, duration=None):
+        # Metadata looked up after the job was queued; a known duration is kept if none is given
+        with self.connection() as conn:
+            conn.execute(
+                "UPDATE jobs SET title = ?, params = json_set(params, '$.title', ?), duration = COALESCE(?, duration), "
+                "updated_at = ? WHERE id = ?",
+                (title, title, duration, ttime(), job_id),
+            )
+
+    def recover(self):
+        # Jobs left running by a previous process were interrupted; run them again. Jobs leased to
+        # remote workers may still be running there, so they are left to expire() instead.
+        with self.connection() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = 'pending', updated_at = ? WHERE state = 'running' AND worker IS NULL", (ttime(),))
+        if cursor.rowcount:
+            logger.info(f"Resuming {cursor.rowcount} interrupted jobs")
+        return cursor.rowcount
+
+    def pending(self, limit=500):
+        rows = self.connection().execute(
+            f"SELECT * FROM jobs WHERE state = 'pending' ORDER BY {ORDER_BY[self.policy]} LIMIT ?", (limit,)
+        ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def count(self, state="pending", stage=None):
+        if stage is None:
+            return self.connection().execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (state,)).fetchone()[0]
+        return self.connection().execute("SELECT COUNT(*) FROM jobs WHERE state = ? AND stage = ?", (state, stage)).fetchone()[0]
+
+    def leased(self):
+        rows = self.connection().execute("SELECT * FROM jobs WHERE state = 'running' AND worker IS NOT NULL ORDER BY id").fetchall()
+        return [self._row(row) for row in rows]
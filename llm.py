@@ -0,0 +1,131 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from logging import getLogger
+
+from resultcache import cache_key, result_cache
+from utils import lazy_import
+
+logger = getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # A single httpx-backed client is thread-safe and pools its connections, so it is shared by
+    # every concurrent request. OLLAMA_HOST points it at another (or a fake) server.
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = lazy_import("ollama").Client(host=os.environ.get("OLLAMA_HOST"))
+        return _client
+
+
+DERIVED_PREFIX = "vsum-"
+# Derived models not used for this long are deleted from Ollama
+DERIVED_MAX_IDLE = 7 * 24 * 3600
+GC_INTERVAL = 3600
+# Last-used times are saved to the result cache at most this often, so they survive restarts
+# (and worker process replacements) without a write per request
+SAVE_INTERVAL = 3600
+
+
+def _modelfile(base, system):
+    return f'''
+FROM {base}
+SYSTEM """{system}"""
+'''
+
+
+def _strip_tag(name):
+    return name[:-len(":latest")] if name.endswith(":latest") else name
+
+
+def _timestamp(value):
+    # Ollama's modified_at, e.g. "2024-05-01T10:20:30.123456789-07:00", as a Unix time, or None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(re.sub(r"(\.\d{6})\d+", r"\1", value)).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class DerivedModels:
+    # Ollama models derived from a base model plus a system prompt. Names are a hash of the
+    # modelfile, so identical requests share one model, and each is created at most once.
+    def __init__(self, max_idle=DERIVED_MAX_IDLE, cache=result_cache):
+        self.max_idle = max_idle
+        self.cache = cache
+        self.last_used = {}
+        self.saved = {}  # name -> last-used time last written to the cache
+        self.synced = False
+        self.last_gc = time.time()
+        self.lock = threading.Lock()
+
+    def name_for(self, base, system):
+        digest = hashlib.sha256(_modelfile(base, system).encode()).hexdigest()[:16]
+        return f"{DERIVED_PREFIX}{digest}"
+
+    def _saved_time(self, name):
+        saved = self.cache.get("derived", cache_key(name))
+        return saved["last_used"] if saved else None
+
+    def sync(self):
+        # Pick up derived models created by earlier runs, so they are reused and can be collected.
+        # Models with no saved last-used time count as last used when Ollama last modified them.
+        models = get_client().list()["models"]
+        now = time.time()
+        with self.lock:
+            for model in models:
+                name = _strip_tag(model["name"])
+                if name.startswith(DERIVED_PREFIX) and name not in self.last_used:
+                    saved = self._saved_time(name)
+                    if saved is not None:
+                        self.saved[name] = saved
+                    self.last_used[name] = saved or _timestamp(model.get("modified_at")) or now
+            self.synced = True
+
+    def get(self, base, system):
+        if not self.synced:
+            self.sync()
+        name = self.name_for(base, system)
+        now = time.time()
+        with self.lock:
+            if name not in self.last_used:
+                logger.info(f"Creating derived model {name} from {base}")
+                get_client().create(model=name, modelfile=_modelfile(base, system))
+            self.last_used[name] = now
+            save = now - self.saved.get(name, 0) > SAVE_INTERVAL
+            if save:
+                self.saved[name] = now
+        if save:
+            self.cache.put("derived", cache_key(name), {"last_used": now})
+        return name
+
+    def collect(self, force=False):
+        now = time.time()
+        if not force and now - self.last_gc < GC_INTERVAL:
+            return []
+        self.last_gc = now
+        with self.lock:
+            # Another process may have used a model since this one last did
+            stale = [name for name, used in self.last_used.items()
+                     if now - max(used, self._saved_time(name) or 0) > self.max_idle]
+            for name in stale:
+                del self.last_used[name]
+                self.saved.pop(name, None)
+        for name in stale:
+            try:
+                get_client().delete(model=name)
+                logger.info(f"Deleted unused derived model {name}")
+            except Exception as e:
+                logger.warning(f"Failed to delete derived model {name}: {str(e)}")
+        return stale
+
+
+derived_models = DerivedModels()
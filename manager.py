@@ -2,88 +2,283 @@ import threading
 import queue
 import logging
 
+from asr import registry
+from artifacts import artifact_path
+from jobqueue import STAGES as JOB_STAGES, JobQueue
+from task import STAGES, SummarizationTask
+from workers import WorkerPool
+import metrics
+import progress
+from search import get_search_index
+from store import get_store
+
 
 logger = logging.getLogger(__name__)
 
+PROCESS_STAGES = ("transcribe", "summarize")
+
 
 class TaskManager:
-    def __init__(self):
-        self.task_queue = queue.Queue()
-        self.current_task = None
-        self.stop_event = threading.Event()
+    # Runs tasks through the download -> decode -> transcribe -> summarize stages. Each stage has its own
+    # workers and a bounded queue in front of it, so consecutive videos overlap across stages.
+    # With processes=True, transcription and summarization run in warm worker processes (see workers.py),
+    # one per stage worker, and stopping a task kills its process mid-stage.
+    # Pending jobs live in a JobQueue on disk, so the backlog survives restarts; interrupted jobs resume.
+    def __init__(self, workers=None, queue_size=2, preload_models=True, processes=True, initializer=None, jobs=None):
+        self.workers = {stage: 1 for stage in STAGES}
+        self.workers.update(workers or {})
+        self.preload_models = preload_models
+        self.pool = WorkerPool({stage: self.workers[stage] for stage in PROCESS_STAGES}, initializer) if processes else None
+        self.jobs = jobs or JobQueue()
+        self.jobs.recover()
+        self.jobs.expire()  # Leases that ran out while no coordinator was serving them
+        self.tasks = {}  # job id -> task, for jobs pending or running in this process
+        self.job_added = threading.Event()
+        self.stage_queues = {stage: queue.Queue(maxsize=queue_size) for stage in STAGES[1:]}
+        self.in_flight = []
+        self.active = {stage: [] for stage in STAGES}
+        self.run_event = threading.Event()  # Set while processing is allowed
         self.lock = threading.Lock()
         self.processing = False
-        self.runner_thread = threading.Thread(target=self._task_runner)
-        self.runner_thread.start()
+        self.shutting_down = False
         self.on_status_change = self._on_status_change
-    
+        self.threads = []
+        for index, stage in enumerate(STAGES):
+            for n in range(self.workers[stage]):
+                thread = threading.Thread(target=self._stage_worker, args=(index,), name=f"{stage}-{n}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        metrics.queue_depth.set_callback(self.get_queue_depths)
+        metrics.stage_occupancy.set_callback(self.get_stage_occupancy)
+
+    @property
+    def current_task(self):
+        with self.lock:
+            return self.in_flight[0] if self.in_flight else None
+
     def _on_status_change(self):
-        if self.current_task:
-            if self.current_task.status == "Complete":
-                if self.task_queue.empty():
-                    logger.info("All tasks complete. Stopping processing.")
-                    self.stop_processing()
-
-    def _task_runner(self):
-        while True:
-            self.stop_event.wait()  # Wait until processing is allowed
-            with self.lock:
-                if self.task_queue.empty():
-                    self.processing = False
+        self._stop_if_idle()
+
+    def _stop_if_idle(self):
+        # Jobs leased to remote workers count as busy, since the llm stage of one may come back here
+        with self.lock:
+            idle = not self.in_flight and not self.jobs.count() and not self.jobs.count("running")
+        if self.processing and idle:
+            logger.info("All tasks complete. Stopping processing.")
+            self.stop_processing()
+
+    def _task_for(self, job):
+        task = self.tasks.get(job["id"])
+        if task is None:
+            task = SummarizationTask(**job["params"], on_status_change=self.on_status_change)
+            task.job_id = job["id"]
+            if self.pool:
+                task.runner = self.pool.run
+            self.tasks[job["id"]] = task
+        return task
+
+    def _claim(self):
+        # -> (task, job stage). Claiming and marking in flight happen under the lock, so a claimed
+        # job is never briefly invisible to _on_status_change
+        with self.lock:
+            job = self.jobs.claim(JOB_STAGES)
+            if job is None:
+                self.job_added.clear()
+                return None, None
+            task = self._task_for(job)
+            self.in_flight.append(task)
+        return task, job["stage"]
+
+    def _summarize_remote(self, task):
+        # A remote worker transcribed this job (see coordinator.py); only summarizing is left
+        try:
+            with open(artifact_path(task.video_id, "transcript"), "r", encoding="utf-8") as f:
+                task.transcript = f.read()
+        except OSError as e:
+            task.set_status(f"Error: {str(e)}")
+            self._finish(task)
+            return
+        self._handoff(task, STAGES[-1])
+
+    def _stage_worker(self, index):
+        stage = STAGES[index]
+        while not self.shutting_down:
+            if not self.run_event.wait(timeout=0.5):  # Wait until processing is allowed
+                continue
+            if index == 0:
+                task, job_stage = self._claim()
+                if task is None:
+                    self._stop_if_idle()
+                    self.job_added.wait(timeout=0.5)
+                    continue
+                if job_stage != JOB_STAGES[0]:
+                    self._summarize_remote(task)
+                    continue
+            else:
+                try:
+                    task = self.stage_queues[stage].get(timeout=0.5)
+                except queue.Empty:
                     continue
-                self.current_task = self.task_queue.get()
-            if self.current_task is None:  # Sentinel to stop the thread
-                break
-            self.stop_event.clear()
+            with self.lock:
+                self.active[stage].append(task)
+            if index == 0:
+                self._preload_models(task)
             try:
-                logger.info(f"Starting task {self.current_task.video_id}")
-                self.current_task.run(self.stop_event)
+                logger.info(f"Starting {stage} for task {task.video_id}")
+                task.run_stage(stage, task.stop_event)
             except Exception as e:
-                logger.error(f"Error while processing task {self.current_task.video_id}: {str(e)}")
-                self.current_task.set_status(f"Error: {str(e)}")
+                logger.error(f"Error while processing task {task.video_id}: {str(e)}")
+                task.set_status(f"Error: {str(e)}")
             with self.lock:
-                self.current_task = None
-            if self.on_status_change:
-                self.on_status_change()
+                self.active[stage].remove(task)
+            if task.stop_event.is_set() and not task.failed:
+                task.set_status("Stopped")
+            if task.failed or task.stop_event.is_set() or index == len(STAGES) - 1:
+                self._finish(task)
+            else:
+                self._handoff(task, STAGES[index + 1])
+
+    def _handoff(self, task, stage):
+        # Blocks while the next stage is backed up, which throttles this stage
+        task.set_status(f"Queued for {stage}")
+        while not self.shutting_down:
+            try:
+                self.stage_queues[stage].put(task, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _finish(self, task):
+        retry = False
+        if task.failed:
+            retry = self.jobs.fail(task.job_id, task.status)
+            outcome = "retried" if retry else "error"
+        elif task.stop_event.is_set():
+            # Shutting down leaves the job to resume on the next start; a user stop cancels it
+            self.jobs.release(task.job_id) if self.shutting_down else self.jobs.cancel(task.job_id)
+            outcome = "stopped"
+        else:
+            self.jobs.complete(task.job_id)
+            outcome = "complete"
+        with self.lock:
+            if task in self.in_flight:
+                self.in_flight.remove(task)
+            if retry:
+                task.reset(f"Pending (retry after: {task.status})")
+            elif not self.shutting_down:
+                self.tasks.pop(task.job_id, None)
+        progress.channel.finish(task.video_id)
+        if retry:
+            logger.info(f"Retrying task {task.video_id}")
+            self.job_added.set()
+        metrics.tasks_finished.inc(outcome=outcome)
+        if self.on_status_change:
+            self.on_status_change()
+
+    def _preload_models(self, task):
+        # Load the ASR models this task and the next queued one need while they download
+        if not self.preload_models:
+            return
+        next_job = self.jobs.peek()
+        models = [(task.model_id, task.language)]
+        if next_job is not None:
+            models.append((next_job["params"]["model_id"], next_job["params"]["language"]))
+        for model_id, language in models:
+            if self.pool:
+                self.pool.warm_up(model_id, language)
+            else:
+                registry.warm_up(model_id, language)
 
     def remove_task(self, video_id):
+        removed = self.jobs.remove(video_id)
         with self.lock:
-            queue_list = list(self.task_queue.queue)
-            self.task_queue = queue.Queue()
-            for task in queue_list:
-                if task.video_id != video_id:
-                    self.task_queue.put(task)
+            for job_id in removed:
+                self.tasks.pop(job_id, None)
         if self.on_status_change:
             self.on_status_change()
 
-    def add_task(self, task):
-        self.task_queue.put(task)
-        if self.processing:
-            self.stop_event.set()
+    def add_task(self, task, priority=0, duration=None):
+        # Returns the task that will run: an identical job already pending or running is reused
+        job, created = self.jobs.submit(task.params(), priority, duration)
+        with self.lock:
+            existing = self.tasks.get(job["id"])
+            if existing is None:
+                task.job_id = job["id"]
+                if self.pool:
+                    task.runner = self.pool.run
+                self.tasks[job["id"]] = existing = task
+        if not created:
+            logger.info(f"Task {task.video_id} is already queued as job {job['id']}")
+        self.job_added.set()
+        if self.on_status_change:
+            self.on_status_change()
+        return existing
+
+    def set_details(self, task, title, duration=None):
+        # Fill in metadata looked up after the task was added, wherever the task has got to
+        self.jobs.set_details(task.job_id, title, duration)
+        task.title = title
+        if get_store().set_title(task.video_id, title):
+            try:
+                get_search_index().index(task.video_id, "title", title)
+            except Exception as e:
+                logger.warning(f"Failed to index title of {task.video_id}: {str(e)}")
         if self.on_status_change:
             self.on_status_change()
 
+    def set_priority(self, video_id, priority):
+        for job in self.jobs.pending_for(video_id):
+            self.jobs.set_priority(job["id"], priority)
+
     def start_processing(self):
         self.processing = True
-        self.stop_event.set()
+        self.run_event.set()
+        self._stop_if_idle()
 
     def stop_processing(self):
         self.processing = False
-        self.stop_event.clear()
+        self.run_event.clear()
 
     def stop_current_task(self):
+        # Stops the tasks running a stage; tasks queued between stages carry on when processing resumes
         with self.lock:
-            if self.current_task is not None:
-                self.stop_event.set()
-                self.current_task = None
-                if self.on_status_change:
-                    self.on_status_change()
+            tasks = [task for stage in STAGES for task in self.active[stage]]
+        for task in tasks:
+            task.stop_event.set()
+        if tasks and self.on_status_change:
+            self.on_status_change()
 
     def stop(self):
-        self.task_queue.put(None)
-        self.runner_thread.join()
+        self.shutting_down = True
+        self.stop_current_task()
+        for thread in self.threads:
+            thread.join()
+        # Tasks still queued between stages resume on the next start
+        with self.lock:
+            waiting = list(self.in_flight)
+        for task in waiting:
+            self.jobs.release(task.job_id)
+        if self.pool:
+            self.pool.close()
+
+    def get_active_tasks(self):
+        with self.lock:
+            return list(self.in_flight)
+
+    def get_stage_occupancy(self):
+        with self.lock:
+            return {stage: len(self.active[stage]) for stage in STAGES}
+
+    def get_queue_depths(self):
+        depths = {"pending": self.jobs.count()}
+        depths.update({stage: q.qsize() for stage, q in self.stage_queues.items()})
+        return depths
 
     def get_table(self):
+        jobs = self.jobs.pending()
         with self.lock:
-            queue_list = list(self.task_queue.queue)
-        return [{"Video ID": task.video_id, "Status": task.status, "Title": task.title , "Language": task.language} for task in queue_list]
+            statuses = {job["id"]: self.tasks[job["id"]].status for job in jobs if job["id"] in self.tasks}
+        # Jobs a remote worker transcribed only need summarizing (see coordinator.py)
+        return [{"Video ID": job["video_id"],
+                 "Status": statuses.get(job["id"], "Pending") if job["stage"] == "asr" else "Transcribed, waiting to be summarized",
+                 "Title": job["title"], "Language": job["params"]["language"]} for job in jobs]
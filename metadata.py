@@ -0,0 +1,193 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from time import time as ttime
+
+from resultcache import cache_key, result_cache
+from utils import VIDEO_ID, lazy_import, parse_sources
+
+logger = getLogger(__name__)
+
+# Video details rarely change; playlist and channel listings do
+METADATA_TTL = float(os.environ.get("METADATA_TTL_HOURS", "168")) * 3600
+LISTING_TTL = float(os.environ.get("LISTING_TTL_HOURS", "1")) * 3600
+METADATA_WORKERS = int(os.environ.get("METADATA_WORKERS", "8"))
+# "yt-dlp", or "fake" for the offline stand-in in fake_extractor.py
+EXTRACTOR = os.environ.get("METADATA_EXTRACTOR", "yt-dlp")
+
+
+class YtDlpExtractor:
+    # Creating a YoutubeDL is expensive, so each lookup thread keeps one and reuses it
+    def __init__(self):
+        self.local = threading.local()
+
+    def _ydl(self, flat=False):
+        ydls = getattr(self.local, "ydls", None)
+        if ydls is None:
+            ydls = self.local.ydls = {}
+        if flat not in ydls:
+            yt_dlp = lazy_import("yt_dlp")
+            options = {"quiet": True, "no_warnings": True, "skip_download": True}
+            if flat:
+                options["extract_flat"] = "in_playlist"
+            ydls[flat] = yt_dlp.YoutubeDL(options)
+        return ydls[flat]
+
+    def video(self, video_id):
+        info = self._ydl().extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+        return {"title": info.get("title"), "duration": info.get("duration")}
+
+    def listing(self, url):
+        # Videos of a playlist or channel, from one flat request rather than one per video
+        info = self._ydl(flat=True).extract_info(url, download=False)
+        return [{"video_id": entry["id"], "title": entry.get("title"), "duration": entry.get("duration")}
+                for entry in info.get("entries") or [] if entry.get("id")]
+
+
+class MetadataResolver:
+    # Looks up video details and playlist/channel listings on a bounded thread pool, caching
+    # them on disk (in the result cache) for METADATA_TTL and LISTING_TTL seconds. Concurrent
+    # requests for the same video share one lookup.
+    def __init__(self, extractor=None, workers=METADATA_WORKERS, ttl=METADATA_TTL, listing_ttl=LISTING_TTL, cache=result_cache):
+        self.extractor = extractor or YtDlpExtractor()
+        self.ttl = ttl
+        self.listing_ttl = listing_ttl
+        self.cache = cache
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="metadata")
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def _cached(self, kind, key, ttl):
+        value = self.cache.get("metadata", cache_key(kind, key))
+        if value is None or ttime() - value["fetched_at"] > ttl:
+            return None
+        return value["data"]
+
+    def _store(self, kind, key, data):
+        self.cache.put("metadata", cache_key(kind, key), {"fetched_at": ttime(), "data": data})
+
+    def cached(self, video_id):
+        return self._cached("video", video_id, self.ttl)
+
+    def details(self, video_id):
+        # {"title", "duration"}, looked up now unless cached
+        details = self.cached(video_id)
+        if details is None:
+            details = self.extractor.video(video_id)
+            self._store("video", video_id, details)
+        return details
+
+    def lookup(self, video_id):
+        # Future of details(video_id)
+        with self.lock:
+            future = self.in_flight.get(video_id)
+            if future is None:
+                future = self.in_flight[video_id] = self.pool.submit(self.details, video_id)
+                future.add_done_callback(lambda _: self._done(video_id))
+        return future
+
+    def _done(self, video_id):
+        with self.lock:
+            self.in_flight.pop(video_id, None)
+
+    def listing(self, url):
+        entries = self._cached("listing", url, self.listing_ttl)
+        if entries is None:
+            entries = self.extractor.listing(url)
+            self._store("listing", url, entries)
+            # Flat listings often carry everything a video lookup would return
+            for entry in entries:
+                if entry.get("title") and entry.get("duration") is not None:
+                    self._store("video", entry["video_id"], {"title": entry["title"], "duration": entry["duration"]})
+        return entries
+
+    def ingest(self, text, enqueue, update=None):
+        # Queues every video named in text (ids, urls, playlists, channels) without waiting for the
+        # network: enqueue(video_id, details) is called as soon as a video's id is known, with cached
+        # details or None, and update(video_id, details) once a missing lookup finishes. Without update,
+        # nothing is looked up. Playlists and channels are listed on the pool. Returns a Batch to wait on.
+        batch = Batch()
+        for kind, value in parse_sources(text):
+            if kind == "video":
+                self._enqueue(batch, value, None, enqueue, update)
+            else:
+                batch.track(self.pool.submit(self._ingest_listing, batch, value, enqueue, update), listing=True)
+        return batch
+
+    def _ingest_listing(self, batch, url, enqueue, update):
+        try:
+            entries = self.listing(url)
+        except Exception as e:
+            logger.error(f"Failed to list videos in {url}: {str(e)}")
+            raise
+        logger.info(f"Found {len(entries)} videos in {url}")
+        for entry in entries:
+            if not VIDEO_ID.match(entry["video_id"]):
+                logger.warning(f"Skipping {entry['video_id']!r} in {url}: not a video id")
+                continue
+            self._enqueue(batch, entry["video_id"], entry, enqueue, update)
+
+    def _enqueue(self, batch, video_id, entry, enqueue, update):
+        details = self.cached(video_id)
+        if details is None and entry and entry.get("title"):
+            details = {"title": entry["title"], "duration": entry.get("duration")}
+        enqueue(video_id, details)
+        batch.add(video_id)
+        if update and (details is None or details.get("duration") is None):
+            future = self.lookup(video_id)
+            future.add_done_callback(lambda f: self._update(video_id, f, update))
+            batch.track(future)
+
+    def _update(self, video_id, future, update):
+        try:
+            update(video_id, future.result())
+        except Exception as e:
+            logger.warning(f"Failed to look up {video_id}: {str(e)}")
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Batch:
+    # Videos queued by one ingest call, and the lookups still running for it
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.video_ids = {}
+        self.listings = []
+        self.lookups = []
+
+    def add(self, video_id):
+        with self.lock:
+            self.video_ids.setdefault(video_id)
+
+    def track(self, future, listing=False):
+        with self.lock:
+            (self.listings if listing else self.lookups).append(future)
+
+    def wait(self, lookups=True):
+        # -> every video id queued. Listings add lookups while they run, so those are waited for last.
+        for futures in (self.listings, self.lookups) if lookups else (self.listings,):
+            for future in futures:
+                try:
+                    future.result()
+                except Exception:
+                    pass  # Logged where it happened
+        with self.lock:
+            return list(self.video_ids)
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_resolver():
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            if EXTRACTOR == "fake":
+                from fake_extractor import FakeExtractor
+                _resolver = MetadataResolver(FakeExtractor())
+            else:
+                _resolver = MetadataResolver()
+        return _resolver
@@ -0,0 +1,265 @@
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# The app serves Prometheus metrics only when METRICS_PORT is set, e.g. to 9464
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+
+
+def _labels_text(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        self.callback = None
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def set_callback(self, callback):
+        # callback() -> {label value or tuple of label values: value}, evaluated on every scrape
+        self.callback = callback
+
+    def collect(self):
+        if self.callback is None:
+            with self.lock:
+                return dict(self.values)
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"Failed to collect {self.name}: {str(e)}")
+            return {}
+        return {k if isinstance(k, tuple) else (k,): v for k, v in values.items()}
+
+    def get(self, **labels):
+        return self.collect().get(self._key(labels), 0)
+
+    def drain(self):
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def render(self):
+        items = sorted(self.collect().items())
+        return self.header() + [f"{self.name}{_labels_text(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def merge(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def merge(self, values):
+        with self.lock:
+            self.values.update(values)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def merge(self, values):
+        with self.lock:
+            for key, (counts, total) in values.items():
+                current, current_total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+                self.values[key] = ([a + b for a, b in zip(current, counts)], current_total + total)
+
+    def snapshot(self, **labels):
+        # (count, sum, per-bucket counts) for one label set
+        with self.lock:
+            counts, total = self.values.get(self._key(labels), ([0] * (len(self.buckets) + 1), 0.0))
+            return sum(counts), total, list(counts)
+
+    def quantile(self, q, **labels):
+        # Estimated by linear interpolation inside the bucket holding the q-th observation
+        count, _, counts = self.snapshot(**labels)
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def label_sets(self):
+        with self.lock:
+            return [dict(zip(self.labelnames, key)) for key in sorted(self.values)]
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            items = sorted((k, (list(c), t)) for k, (c, t) in self.values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _labels_text(self.labelnames + ("le",), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def drain(self):
+        # Take every recorded value, leaving the metrics empty; worker processes ship these to the parent
+        return {metric.name: metric.drain() for metric in self.metrics if metric.callback is None}
+
+    def merge(self, values):
+        by_name = {metric.name: metric for metric in self.metrics}
+        for name, metric_values in values.items():
+            if name in by_name and metric_values:
+                by_name[name].merge(metric_values)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_duration = registry.register(Histogram(
+    "vsum_stage_duration_seconds", "Time spent in each task stage", ("stage",)))
+tasks_finished = registry.register(Counter(
+    "vsum_tasks_finished_total", "Tasks that left the pipeline, by outcome", ("outcome",)))
+asr_audio_seconds = registry.register(Counter(
+    "vsum_asr_audio_seconds_total", "Seconds of audio transcribed"))
+asr_skipped_seconds = registry.register(Counter(
+    "vsum_asr_skipped_seconds_total", "Seconds of audio skipped as silence before transcription"))
+asr_wall_seconds = registry.register(Counter(
+    "vsum_asr_wall_seconds_total", "Wall-clock seconds spent transcribing"))
+asr_speed = registry.register(Histogram(
+    "vsum_asr_speed_ratio", "Audio seconds transcribed per wall second, per transcription", buckets=RATE_BUCKETS))
+llm_prompt_tokens = registry.register(Counter(
+    "vsum_llm_prompt_tokens_total", "Prompt tokens evaluated by Ollama", ("model",)))
+llm_eval_tokens = registry.register(Counter(
+    "vsum_llm_eval_tokens_total", "Tokens generated by Ollama", ("model",)))
+llm_eval_rate = registry.register(Histogram(
+    "vsum_llm_eval_tokens_per_second", "Generation speed of each Ollama request", ("model",), buckets=RATE_BUCKETS))
+llm_prompt_rate = registry.register(Histogram(
+    "vsum_llm_prompt_tokens_per_second", "Prompt evaluation speed of each Ollama request", ("model",),
+    buckets=RATE_BUCKETS + (2000, 5000, 10000)))
+llm_request_duration = registry.register(Histogram(
+    "vsum_llm_request_duration_seconds", "Wall-clock time of each Ollama request", ("model",)))
+llm_first_token = registry.register(Histogram(
+    "vsum_llm_time_to_first_token_seconds", "Time from sending an Ollama request to its first streamed token", ("model",),
+    buckets=LATENCY_BUCKETS))
+queue_depth = registry.register(Gauge(
+    "vsum_queue_depth", "Tasks waiting in front of each stage", ("queue",)))
+stage_occupancy = registry.register(Gauge(
+    "vsum_stage_occupancy", "Tasks currently running in each stage", ("stage",)))
+cache_requests = registry.register(Counter(
+    "vsum_result_cache_requests_total", "Result cache lookups, by namespace and result", ("namespace", "result")))
+
+
+def observe_llm(model, chat, seconds, first_token=None):
+    # Ollama reports token counts and durations (in nanoseconds) in the last part of every response
+    prompt_count, eval_count = chat.get("prompt_eval_count") or 0, chat.get("eval_count") or 0
+    llm_prompt_tokens.inc(prompt_count, model=model)
+    llm_eval_tokens.inc(eval_count, model=model)
+    llm_request_duration.observe(seconds, model=model)
+    if first_token is not None:
+        llm_first_token.observe(first_token, model=model)
+    if chat.get("eval_duration"):
+        llm_eval_rate.observe(eval_count / (chat["eval_duration"] / 1e9), model=model)
+    if chat.get("prompt_eval_duration"):
+        llm_prompt_rate.observe(prompt_count / (chat["prompt_eval_duration"] / 1e9), model=model)
+
+
+def observe_asr(audio_seconds, wall_seconds):
+    asr_audio_seconds.inc(audio_seconds)
+    asr_wall_seconds.inc(wall_seconds)
+    if wall_seconds > 0:
+        asr_speed.observe(audio_seconds / wall_seconds)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    # -> the server, or None if the port could not be bound
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        logger.error(f"Could not serve metrics on {host}:{port}: {str(e)}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
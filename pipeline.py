@@ -1,78 +1,192 @@
-import yt_dlp
 import os
-import torch
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+import threading
 from logging import getLogger
-import ollama
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from asr import DECODING_PARAMS, SEGMENT_SECONDS, registry, resolve
+from llm import derived_models, get_client
+from artifacts import artifact_cache, artifact_path
+from search import get_search_index
+from utils import lazy_import
+from decode import SAMPLE_RATE, decode, load_pcm, pcm_path
+from resultcache import cache_key, file_digest, result_cache, text_digest
+from chunking import ContextBudget, chunker, get_tokenizer
+from checkpoint import Checkpoint, CheckpointLog
+import vad
+from segments import load_segments, segments_path, write_segments
+import metrics
+import progress
 
 logger = getLogger(__name__)
 
+# Optional replacement for the YouTube download, called as downloader(video_id) -> audio path;
+# bench.py uses it to serve local audio files
+downloader = None
+# Generated text is written and published to the progress channel at most this often, in seconds
+FLUSH_INTERVAL = 0.5
+# Chunks sent to the LLM are marked with the time of the transcript every this many seconds, so
+# summaries can cite where each topic starts; 0 turns citations off
+CITE_SECONDS = int(os.environ.get("CITE_SECONDS", "60"))
+
+
+def report_status(on_status, text):
+    if on_status:
+        on_status(text)
+
+
+class StreamWriter:
+    # Appends generated text to an artifact file as it arrives, flushing (without fsync) and
+    # publishing it to the progress channel at most every FLUSH_INTERVAL seconds
+    def __init__(self, video_id, kind, text=""):
+        self.video_id = video_id
+        self.kind = kind
+        self.file = open(artifact_path(video_id, kind), "w")
+        self.file.write(text)
+        self.pending = ""
+        self.written = 0
+        self.last_flush = perf_counter()
+        progress.channel.start(video_id, kind, text)
+
+    def write(self, delta):
+        self.pending += delta
+        self.written += len(delta)
+        if perf_counter() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write(self.pending)
+            self.file.flush()
+            progress.channel.append(self.video_id, self.kind, self.pending)
+            self.pending = ""
+        self.last_flush = perf_counter()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def write_artifact(video_id, kind, text):
+    with open(artifact_path(video_id, kind), "w") as f:
+        f.write(text)
+    artifact_cache.notify(video_id, kind)
+    try:
+        get_search_index().index(video_id, kind, text)
+    except Exception as e:
+        logger.warning(f"Failed to index {kind} of {video_id}: {str(e)}")
+
+
 def download(video_id):
+    # Keep the original audio stream; decode.decode() turns it into PCM without a lossy re-encode
+    if downloader is not None:
+        return downloader(video_id)
     video_url = f'https://www.youtube.com/watch?v={video_id}'
     ydl_opts = {
-        'format': 'm4a/bestaudio/best',
+        'format': 'bestaudio/best',
         'paths': {'home': 'audio/'},
         'outtmpl': {'default': '%(id)s.%(ext)s'},
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'm4a',
-        }]
     }
+    yt_dlp = lazy_import("yt_dlp")
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        error_code = ydl.download([video_url])
-        if error_code != 0:
+        info = ydl.extract_info(video_url, download=True)
+        if not info:
             raise Exception('Failed to download video')
+        downloads = info.get('requested_downloads') or []
+        if downloads and downloads[0].get('filepath'):
+            return downloads[0]['filepath']
+        return ydl.prepare_filename(info)
 
-    return f'audio/{video_id}.m4a'
 
+def _segments(audio, seconds, search_seconds=5):
+    # (start, end) sample offsets of consecutive segments of about `seconds`, each ending at the
+    # quietest 100 ms in its last search_seconds so no word is split between two segments
+    np = lazy_import("numpy")
+    size, search, frame = int(seconds * SAMPLE_RATE), int(search_seconds * SAMPLE_RATE), SAMPLE_RATE // 10
+    start = 0
+    while start < len(audio):
+        end = start + size
+        if end >= len(audio):
+            yield start, len(audio)
+            return
+        low = max(start + frame, end - search)
+        frames = (end - low) // frame
+        if frames:
+            window = np.asarray(audio[low:low + frames * frame], dtype=np.float32).reshape(frames, frame)
+            end = low + int(np.square(window).sum(axis=1).argmin()) * frame + frame // 2
+        yield start, end
+        start = end
 
-def transcribe(video_id, model_id="openai/whisper-large-v3", language="en"):
-    if os.path.exists(f"transcripts/{video_id}.txt"):
-        with open(f"transcripts/{video_id}.txt", "r") as f:
-            logger.info("Loading existing transcript...")
-            transcript = f.read()
+
+def _timestamped(result, offset, end):
+    # [start, end, text] in seconds of the whole audio for every timestamped chunk of a pipeline
+    # result; Whisper leaves the end of a segment's last chunk open
+    segments = []
+    for chunk in result.get("chunks") or [{"timestamp": (0.0, None), "text": result["text"]}]:
+        start, stop = chunk["timestamp"]
+        start = offset + start if start is not None else (segments[-1][1] if segments else offset)
+        stop = min(offset + stop, end) if stop is not None else end
+        segments.append([round(start, 2), round(max(stop, start), 2), chunk["text"].strip()])
+    return segments
+
+
+def transcribe(video_id, model_id="openai/whisper-large-v3", language="en", on_status=None):
+    # Transcripts are cached by audio content and every parameter that affects the text
+    if not os.path.exists(pcm_path(video_id)):
+        decode(video_id)
+    # A quantized model can decode differently, so the dtype is part of the key
+    dtype = resolve()[1]
+    parts = [file_digest(pcm_path(video_id)), model_id, language, DECODING_PARAMS, dtype, SEGMENT_SECONDS]
+    if vad.ENABLED:
+        parts.append(vad.PARAMS)
+    key = cache_key("transcript", *parts)
+    cached = result_cache.get("transcripts", key)
+    if cached is not None:
+        logger.info("Loading cached transcript...")
+        transcript = cached["text"]
+        # Transcripts cached before segments were kept only have their text
+        if cached.get("segments") is not None:
+            write_segments(segments_path(video_id), cached["segments"])
     else:
-        filepath = f'audio/{video_id}.m4a'
-        device = "mps"
-        torch_dtype = torch.float32
-
-        model = AutoModelForSpeechSeq2Seq.from_pretrained(
-            model_id, torch_dtype=torch_dtype, use_safetensors=True
-        )
-        model.to(device)
-
-        processor = AutoProcessor.from_pretrained(model_id, language=language)
-
-        pipe = pipeline(
-            "automatic-speech-recognition",
-            model=model,
-            tokenizer=processor.tokenizer,
-            feature_extractor=processor.feature_extractor,
-            max_new_tokens=128,
-            chunk_length_s=30,
-            batch_size=16,
-            return_timestamps=True,
-            torch_dtype=torch_dtype,
-            device=device,
-        )
-        logger.info("Transcribing audio...")
-        transcript = pipe(filepath)["text"]
-        with open(f"transcripts/{video_id}.txt", "w") as f:
-            f.write(transcript)
+        audio = load_pcm(video_id)
+        if vad.ENABLED:
+            # Only speech reaches Whisper, packed end to end so its 30 s windows are full of it
+            audio = vad.PackedAudio(audio, vad.speech_regions(audio))
+            logger.info(f"Skipping {audio.skipped:.0%} of the audio as silence ({len(audio.regions)} speech regions)")
+            metrics.asr_skipped_seconds.inc(audio.skipped * len(audio.audio) / SAMPLE_RATE)
+        segments = list(_segments(audio, SEGMENT_SECONDS))
+        # One line per transcribed segment, holding its timestamped pieces; a crash loses at most the
+        # segment being transcribed
+        checkpoint = CheckpointLog("transcript", video_id, cache_key(key, "segments"))
+        done = checkpoint.load()[:len(segments)]
+        if done:
+            logger.info(f"Resuming transcription at segment {len(done) + 1} of {len(segments)}")
+        if len(done) < len(segments):
+            if not registry.is_loaded(model_id, language):
+                report_status(on_status, "Transcribing (loading model)")
+            pipe = registry.get(model_id, language)
+        for index in range(len(done), len(segments)):
+            start, end = segments[index]
+            segment = audio[start:end]
+            batch_size = registry.batch_size(model_id, language, len(segment) / SAMPLE_RATE)
+            logger.info(f"Transcribing segment {index + 1} of {len(segments)} (batch size {batch_size})...")
+            report_status(on_status, f"Transcribing ({index + 1} of {len(segments)})")
+            started = perf_counter()
+            result = pipe({"raw": segment, "sampling_rate": SAMPLE_RATE}, batch_size=batch_size)
+            metrics.observe_asr(len(segment) / SAMPLE_RATE, perf_counter() - started)
+            timestamped = _timestamped(result, start / SAMPLE_RATE, end / SAMPLE_RATE)
+            if vad.ENABLED:
+                timestamped = [[round(audio.original_time(s), 2), round(audio.original_time(e, end=True), 2), text] for s, e, text in timestamped]
+            checkpoint.append(timestamped)
+            done.append(timestamped)
+        timed = [piece for pieces in done for piece in pieces]
+        transcript = write_segments(segments_path(video_id), timed)
+        result_cache.put("transcripts", key, {"text": transcript, "segments": timed, "model_id": model_id, "language": language})
+        checkpoint.clear()
+    write_artifact(video_id, "transcript", transcript)
     return transcript
 
 
-# Generator function to split the transcript into chunks with overlapping content
-def chunker(transcript: str, chunk_size: int = 6000, overlap: int = 500):
-    # Create a rolling window of ~3000 characters, find the last period, and truncate the transcript there. Repeat until the entire transcript is processed.
-    while transcript:
-        yield transcript[:chunk_size]
-        transcript = transcript[chunk_size - overlap:]
-
-def summarize(transcript, video_id, model="llama3:70b-instruct", chunk_size=6000, overlap=500, abstract=True):
-    modelfile=f'''
-FROM {model}
-SYSTEM """
+SUMMARIZER_SYSTEM = """
 # ROLE: News Analyst
 You are a news analyst. You will read a transcript of a youtube video, and extract stories, news, opinions, events from it like a journalist. You will convert the transcript into a detailed journalistic expression that captures the main points and key ideas of the video, with each news item or topic covered in a separate section.
 **BE SURE TO INCLUDE ALL THE TOPICS/NEWS/INFORMATION FROM THE VIDEO IN YOUR SUMMARY.**
@@ -93,43 +207,194 @@ Use markdown to express the news items, events, topics, shared opinions, etc.. i
 **USE LINKS FOR REFERENCES**
 **USE BLOCKQUOTES FOR LONG QUOTES**
 """
-'''
-    summary = ""
-    abstract_txt = ""
-    ctx = []
-    try:
-        ollama.delete(model="llama-summarizer")
-    except:
-        pass
-    ollama.create(model="llama-summarizer", modelfile=modelfile)
-    for chunk in chunker(transcript, chunk_size, overlap):
-        chat = ollama.generate(
-            stream=False, model="llama-summarizer", prompt=chunk, context=ctx
-        )
-        summary += chat['response']
-        ctx = chat['context']
-    with open(f"summaries/{video_id}.md", "w") as f:
-        f.write(summary)
-    if abstract:
-        modelfile=f'''
-FROM {model}
-SYSTEM """
+
+REDUCER_SYSTEM = """
+# ROLE: Editor
+You are an editor. You will read consecutive partial summaries of one youtube video, in order, and merge them into a single summary.
+**KEEP EVERY NEWS ITEM, EVENT AND TOPIC FROM THE PARTIAL SUMMARIES, IN THE ORDER THEY APPEAR**
+**MERGE SECTIONS THAT COVER THE SAME TOPIC**
+**DO NOT INCLUDE ANY INFORMATION THAT IS NOT IN THE PARTIAL SUMMARIES**
+# STYLE: Journalistic
+Use markdown. Keep the headings, bullet points, quotes and emphasis of the partial summaries.
+"""
+
+ABSTRACTOR_SYSTEM = """
 # ROLE: Abstractor
 You are an abstractor. You will read a summary of a youtube video, and summarize it. Pay attention to the main points and the key ideas.
 **DO NOT INCLUDE YOUR OPINION, ONLY THE FACTS AND INFORMATION FROM THE VIDEO**
 **DO NOT OUTPUT ANYTHING ELSE**
 # FORMAT: Markdown
 """
-'''
+
+CITE_NOTE = """**THE TRANSCRIPT IS MARKED WITH TIMES LIKE [12:34]. CITE THE TIME WHERE EACH NEWS ITEM OR TOPIC STARTS NEXT TO ITS HEADING, IN THE SAME FORMAT**
+"""
+
+REDUCER_CITE_NOTE = """**KEEP THE TIMES LIKE [12:34] CITED IN THE PARTIAL SUMMARIES, ON THE SECTIONS THEY BELONG TO**
+"""
+
+SUMMARY_MODES = ("sequential", "map-reduce")
+
+
+def _generate(spec, prompt, context=None, on_token=None):
+    # spec is (base model, system prompt, use_derived). Calls are cached by base model, system
+    # prompt, prompt and carried context, so any chunk already summarized is never sent again.
+    # The response is streamed; on_token(text) is called with each piece as it arrives.
+    base, system, use_derived = spec
+    key = cache_key("generate", base, text_digest(system), text_digest(prompt), context or [])
+    cached = result_cache.get("llm", key)
+    if cached is not None:
+        if on_token:
+            on_token(cached['response'])
+        return cached
+    # Either bake the system prompt into a cached derived model, or send it with every request
+    model, system = (derived_models.get(base, system), "") if use_derived else (base, system)
+    start = perf_counter()
+    first_token, pieces, final = None, [], {}
+    for part in get_client().generate(
+        stream=True, model=model, system=system, prompt=prompt, context=context or []
+    ):
+        if part.get('response'):
+            if first_token is None:
+                first_token = perf_counter() - start
+            pieces.append(part['response'])
+            if on_token:
+                on_token(part['response'])
+        if part.get('done'):
+            final = part
+    if not final:
+        # The stream was cut off; a partial response must not be cached or carried on as context
+        raise Exception(f"Ollama stream for {base} ended before the response was done")
+    metrics.observe_llm(base, final, perf_counter() - start, first_token)
+    result = {"response": "".join(pieces), "context": final.get('context', [])}
+    result_cache.put("llm", key, result)
+    return result
+
+
+def _summarize_sequential(transcript, summarizer, chunk_size, overlap, tokenizer, budget, checkpoint, video_id, on_status, segments=None):
+    # Each chunk is summarized with the previous chunks' context carried over. The summary and
+    # context so far are checkpointed after every chunk, and the summary file grows as it streams.
+    state = checkpoint.load() or {"done": 0, "summary": "", "ctx": []}
+    summary, ctx = state["summary"], state["ctx"]
+    if state["done"]:
+        logger.info(f"Resuming summary after chunk {state['done']}")
+    chunks = list(chunker(transcript, chunk_size, overlap, tokenizer, segments, CITE_SECONDS))
+    writer = StreamWriter(video_id, "summary", summary)
+    try:
+        for index in range(state["done"], len(chunks)):
+            report_status(on_status, f"Summarizing (chunk {index + 1} of {len(chunks)})")
+            ctx, prompt = budget.apply(ctx, summary, chunks[index])
+            chat = _generate(summarizer, prompt, ctx, on_token=writer.write)
+            summary += chat['response']
+            ctx = chat['context']
+            checkpoint.save({"done": index + 1, "summary": summary, "ctx": ctx})
+    finally:
+        writer.close()
+    return summary
+
+
+def _group(texts, size, tokenizer):
+    # Pack consecutive texts into groups of at most `size` tokens, at least two per group
+    groups, current, length = [], [], 0
+    for text in texts:
+        tokens = tokenizer.count(text)
+        if len(current) >= 2 and length + tokens > size:
+            groups.append(current)
+            current, length = [], 0
+        current.append(text)
+        length += tokens
+    if len(current) == 1 and groups:
+        groups[-1].append(current[0])
+    elif current:
+        groups.append(current)
+    return groups
+
+
+def _map_checkpointed(pool, fn, items, state, checkpoint, on_done=None):
+    # pool.map(fn, items), skipping items already finished in state["finished"] and saving the
+    # checkpoint as each one completes; on_done(finished count) follows every completion
+    lock = threading.Lock()
+
+    def run(index):
+        if str(index) in state["finished"]:
+            return state["finished"][str(index)]
+        result = fn(items[index])
+        with lock:
+            state["finished"][str(index)] = result
+            checkpoint.save(state)
+            if on_done:
+                on_done(len(state["finished"]))
+        return result
+
+    return list(pool.map(run, range(len(items))))
+
+
+def _summarize_map_reduce(transcript, summarizer, reducer, chunk_size, overlap, tokenizer, concurrency, checkpoint, video_id, on_status, segments=None):
+    # Chunks are summarized independently and concurrently, then the partial summaries are
+    # merged in ordered groups, level by level, until a single summary is left. Level 0 is the
+    # chunk summaries; the checkpoint holds the last finished level and what is done of the next.
+    # Only the final merge is streamed to the summary file.
+    state = checkpoint.load() or {"level": 0, "partials": None, "finished": {}}
+    if state["level"] or state["finished"]:
+        logger.info(f"Resuming map-reduce summary at level {state['level']}")
+    writer = StreamWriter(video_id, "summary")
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            if state["level"] == 0:
+                chunks = list(chunker(transcript, chunk_size, overlap, tokenizer, segments, CITE_SECONDS))
+                report_status(on_status, f"Summarizing (chunk {len(state['finished'])} of {len(chunks)})")
+                partials = _map_checkpointed(pool, lambda chunk: _generate(summarizer, chunk)['response'], chunks, state, checkpoint,
+                                             lambda done: report_status(on_status, f"Summarizing (chunk {done} of {len(chunks)})"))
+                state = {"level": 1, "partials": partials, "finished": {}}
+                checkpoint.save(state)
+            partials = state["partials"]
+            while len(partials) > 1:
+                level = state["level"]
+                groups = _group(partials, chunk_size, tokenizer)
+                logger.info(f"Reducing {len(partials)} partial summaries into {len(groups)} (level {level})")
+                report_status(on_status, f"Summarizing (reducing, level {level})")
+                on_token = writer.write if len(groups) == 1 else None
+                partials = _map_checkpointed(pool, lambda group: _generate(reducer, "\n\n---\n\n".join(group), on_token=on_token)['response'],
+                                             groups, state, checkpoint)
+                state = {"level": level + 1, "partials": partials, "finished": {}}
+                checkpoint.save(state)
+        summary = partials[0] if partials else ""
+        if not writer.written:
+            writer.write(summary)
+    finally:
+        writer.close()
+    return summary
+
+
+def summarize(transcript, video_id, model="llama3:70b-instruct", chunk_size=6000, overlap=500, abstract=True, mode="sequential", concurrency=4, use_derived=True, tokenizer="chars", context_budget=4096, on_status=None):
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"Unknown summarization mode: {mode}")
+    abstract_txt = ""
+    # Times can only be cited from segments of this very transcript
+    segments = load_segments(video_id, transcript) if CITE_SECONDS else None
+    summarizer_system, reducer_system = (SUMMARIZER_SYSTEM + CITE_NOTE, REDUCER_SYSTEM + REDUCER_CITE_NOTE) if segments else (SUMMARIZER_SYSTEM, REDUCER_SYSTEM)
+    # Progress is only resumed for the same transcript, prompts and settings
+    checkpoint = Checkpoint("summary", video_id, cache_key(
+        "summary", text_digest(transcript), text_digest(summarizer_system + reducer_system), model, chunk_size, overlap,
+        mode, use_derived, tokenizer, context_budget, CITE_SECONDS if segments else 0,
+    ))
+    tokenizer = get_tokenizer(tokenizer)
+    summarizer = (model, summarizer_system, use_derived)
+    if mode == "map-reduce":
+        reducer = (model, reducer_system, use_derived)
+        summary = _summarize_map_reduce(transcript, summarizer, reducer, chunk_size, overlap, tokenizer, concurrency, checkpoint, video_id, on_status, segments)
+    else:
+        summary = _summarize_sequential(transcript, summarizer, chunk_size, overlap, tokenizer, ContextBudget(context_budget), checkpoint, video_id, on_status, segments)
+    write_artifact(video_id, "summary", summary)
+    if abstract:
+        report_status(on_status, "Summarizing (abstract)")
+        writer = StreamWriter(video_id, "abstract")
         try:
-            ollama.delete(model="llama-abstractor")
-        except:
-            pass
-        ollama.create(model="llama-abstractor", modelfile=modelfile)
-        chat = ollama.generate(
-            stream=False, model="llama-abstractor", prompt=summary
-        )
-        abstract_txt = chat['response']
-        with open(f"abstracts/{video_id}.md", "w") as f:
-            f.write(abstract_txt)
+            abstract_txt = _generate((model, ABSTRACTOR_SYSTEM, use_derived), summary, on_token=writer.write)['response']
+        finally:
+            writer.close()
+        write_artifact(video_id, "abstract", abstract_txt)
+    checkpoint.clear()
+    progress.channel.finish(video_id)
+    derived_models.collect()
+    logger.info(f"Result cache: {result_cache.stats()}")
     return summary, abstract_txt
@@ -0,0 +1,48 @@
+import threading
+
+# Text being generated right now, per video and artifact kind, for the UI to show while a task runs.
+# Worker processes set a listener that forwards every change to the parent process, which replays it
+# on its own channel (see workers.py).
+
+
+class ProgressChannel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = {}  # video_id -> {"version": int, "texts": {kind: text}}
+        self.listener = None  # listener(method, args)
+
+    def _notify(self, method, *args):
+        if self.listener:
+            self.listener(method, args)
+
+    def start(self, video_id, kind, text=""):
+        with self.lock:
+            stream = self.streams.setdefault(video_id, {"version": 0, "texts": {}})
+            stream["texts"][kind] = text
+            stream["version"] += 1
+        self._notify("start", video_id, kind, text)
+
+    def append(self, video_id, kind, delta):
+        with self.lock:
+            stream = self.streams.setdefault(video_id, {"version": 0, "texts": {}})
+            stream["texts"][kind] = stream["texts"].get(kind, "") + delta
+            stream["version"] += 1
+        self._notify("append", video_id, kind, delta)
+
+    def finish(self, video_id):
+        with self.lock:
+            self.streams.pop(video_id, None)
+        self._notify("finish", video_id)
+
+    def get(self, video_id):
+        # -> (version, {kind: text}) or None if nothing is streaming for video_id
+        with self.lock:
+            stream = self.streams.get(video_id)
+            return (stream["version"], dict(stream["texts"])) if stream else None
+
+    def active(self):
+        with self.lock:
+            return list(self.streams)
+
+
+channel = ProgressChannel()
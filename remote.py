@@ -0,0 +1,201 @@
+import importlib
+import json
+import os
+import socket
+import threading
+import urllib.error
+import urllib.request
+from logging import getLogger
+from time import monotonic
+
+from artifacts import ARTIFACT_PATHS, artifact_path
+from jobqueue import STAGES
+from segments import segments_path
+from task import SummarizationTask
+from workers import WorkerPool
+
+logger = getLogger(__name__)
+
+# A worker on another machine: leases jobs from a coordinator (see coordinator.py), runs the stages
+# it is capable of, and uploads what they produce. "asr" workers download, decode and transcribe;
+# "llm" workers summarize a transcript fetched from the coordinator.
+POLL_SECONDS = float(os.environ.get("REMOTE_POLL_SECONDS", "2"))
+TOKEN = os.environ.get("COORDINATOR_TOKEN") or None
+# Task stages run for each job stage, and the worker processes they need
+TASK_STAGES = {"asr": ("download", "decode", "transcribe"), "llm": ("summarize",)}
+PROCESS_KINDS = {"asr": "transcribe", "llm": "summarize"}
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class CoordinatorClient:
+    def __init__(self, url, worker, token=TOKEN, timeout=60):
+        self.url = url.rstrip("/")
+        self.worker = worker
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, method, path, body=None, data=None):
+        headers = {"X-Worker": self.worker}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if body is not None:
+            data = json.dumps({"worker": self.worker, **body}).encode()
+            headers["Content-Type"] = "application/json"
+        request = urllib.request.Request(f"{self.url}{path}", data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            message = e.read().decode(errors="replace")
+            if e.code == 409:
+                raise LeaseLost(message)
+            if e.code == 404 and method == "GET":
+                return None
+            raise Exception(f"Coordinator returned {e.code} for {method} {path}: {message}")
+
+    def lease(self, capabilities):
+        return json.loads(self._request("POST", "/jobs/lease", {"capabilities": list(capabilities)}))["job"]
+
+    def heartbeat(self, job_id, status=None):
+        self._request("POST", f"/jobs/{job_id}/heartbeat", {"status": status})
+
+    def upload(self, job_id, kind, data):
+        self._request("PUT", f"/jobs/{job_id}/artifacts/{kind}", data=data)
+
+    def download(self, job_id, kind):
+        return self._request("GET", f"/jobs/{job_id}/artifacts/{kind}")
+
+    def complete(self, job_id):
+        self._request("POST", f"/jobs/{job_id}/complete", {})
+
+    def fail(self, job_id, error):
+        return json.loads(self._request("POST", f"/jobs/{job_id}/fail", {"error": error}))["retry"]
+
+
+def _read(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class RemoteWorker:
+    def __init__(self, url, capabilities=STAGES, name=None, processes=True, initializer=None, token=TOKEN, poll=POLL_SECONDS):
+        unknown = set(capabilities) - set(STAGES)
+        if unknown:
+            raise ValueError(f"Unknown capabilities: {', '.join(sorted(unknown))}")
+        self.capabilities = tuple(capabilities)
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.client = CoordinatorClient(url, self.name, token)
+        self.poll = poll
+        self.jobs = 0
+        # initializer is ("module:function", args), run here and, as for WorkerPool, in every worker process
+        if initializer:
+            module, _, function = initializer[0].partition(":")
+            getattr(importlib.import_module(module), function)(*initializer[1])
+        self.pool = WorkerPool({PROCESS_KINDS[c]: 1 for c in self.capabilities}, initializer) if processes else None
+        for directory in {os.path.dirname(path) for path in ARTIFACT_PATHS.values()} | {"audio"}:
+            os.makedirs(directory, exist_ok=True)
+
+    def run(self, stop_event=None, idle_exit=None):
+        # Work until stop_event is set, or until no job has been available for idle_exit seconds
+        stop_event = stop_event or threading.Event()
+        idle_since = monotonic()
+        logger.info(f"Worker {self.name} ({', '.join(self.capabilities)}) polling {self.client.url}")
+        try:
+            while not stop_event.is_set():
+                try:
+                    job = self.client.lease(self.capabilities)
+                except Exception as e:
+                    logger.warning(f"Could not lease a job: {str(e)}")
+                    job = None
+                if job is None:
+                    if idle_exit is not None and monotonic() - idle_since > idle_exit:
+                        break
+                    stop_event.wait(self.poll)
+                    continue
+                self.process(job)
+                idle_since = monotonic()
+        finally:
+            if self.pool:
+                self.pool.close()
+        return self.jobs
+
+    def process(self, job):
+        job_id, stage = job["id"], job["stage"]
+        task = SummarizationTask(**job["params"])
+        task.runner = self.pool.run if self.pool else None
+        task.add_to_library = False
+        lost = threading.Event()  # Set when the lease is lost, which cancels the running stage
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, task, job["lease_seconds"], lost, finished), daemon=True)
+        heartbeat.start()
+        logger.info(f"Running {stage} of job {job_id} ({task.video_id})")
+        try:
+            if stage == "llm":
+                self._fetch_transcript(job_id, task)
+            for name in TASK_STAGES[stage]:
+                if lost.is_set() or task.failed:
+                    break
+                task.run_stage(name, lost)
+            if lost.is_set():
+                logger.warning(f"Lost the lease on job {job_id}, dropping it")
+                return
+            if task.failed:
+                self.client.fail(job_id, task.status)
+                return
+            self._upload(job_id, stage, task)
+            self.client.complete(job_id)
+            self.jobs += 1
+        except LeaseLost:
+            logger.warning(f"Lost the lease on job {job_id}, dropping it")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            try:
+                self.client.fail(job_id, str(e))
+            except Exception as report_error:
+                logger.warning(f"Could not report failure of job {job_id}: {str(report_error)}")
+        finally:
+            finished.set()
+            heartbeat.join()
+
+    def _heartbeat(self, job_id, task, lease_seconds, lost, finished):
+        # Renew the lease a few times per lease period; the coordinator only hears the latest status
+        while not finished.wait(lease_seconds / 3):
+            try:
+                self.client.heartbeat(job_id, task.status)
+            except LeaseLost:
+                lost.set()
+                return
+            except Exception as e:
+                logger.warning(f"Heartbeat for job {job_id} failed: {str(e)}")
+
+    def _fetch_transcript(self, job_id, task):
+        data = self.client.download(job_id, "transcript")
+        if data is None:
+            raise Exception(f"The coordinator has no transcript for {task.video_id}")
+        task.transcript = data.decode()
+        with open(artifact_path(task.video_id, "transcript"), "wb") as f:
+            f.write(data)
+        # Segments let the summary cite times; without them it is summarized without
+        segments = self.client.download(job_id, "segments")
+        if segments is not None:
+            with open(segments_path(task.video_id), "wb") as f:
+                f.write(segments)
+        elif os.path.exists(segments_path(task.video_id)):
+            os.remove(segments_path(task.video_id))
+
+    def _upload(self, job_id, stage, task):
+        files = {
+            "asr": {"transcript": artifact_path(task.video_id, "transcript"), "segments": segments_path(task.video_id)},
+            "llm": {"summary": artifact_path(task.video_id, "summary"),
+                    "abstract": artifact_path(task.video_id, "abstract") if task.get_abstract else None},
+        }[stage]
+        for kind, path in files.items():
+            data = _read(path) if path else None
+            if data is not None:
+                self.client.upload(job_id, kind, data)
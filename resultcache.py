@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import threading
+from logging import getLogger
+
+import metrics
+
+logger = getLogger(__name__)
+
+CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "cache")
+CACHE_MAX_MB = int(os.environ.get("RESULT_CACHE_MAX_MB", "2048"))
+
+
+def cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+_file_digests = {}
+
+
+def file_digest(path):
+    # Content hash of a file, remembered until its size or mtime changes
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    if memo_key not in _file_digests:
+        with open(path, "rb") as f:
+            _file_digests[memo_key] = hashlib.file_digest(f, "sha256").hexdigest()
+    return _file_digests[memo_key]
+
+
+class ResultCache:
+    # Content-addressed JSON cache on disk: cache/<namespace>/<key[:2]>/<key>.json.
+    # Hits refresh the file's mtime, and the least recently used files are evicted
+    # once the cache grows past max_bytes.
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = None
+        self.hits = {}
+        self.misses = {}
+
+    def _path(self, namespace, key):
+        return os.path.join(self.directory, namespace, key[:2], f"{key}.json")
+
+    def get(self, namespace, key):
+        path = self._path(namespace, key)
+        try:
+            with open(path, "r") as f:
+                value = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses[namespace] = self.misses.get(namespace, 0) + 1
+            metrics.cache_requests.inc(namespace=namespace, result="misses")
+            return None
+        with self.lock:
+            self.hits[namespace] = self.hits.get(namespace, 0) + 1
+        metrics.cache_requests.inc(namespace=namespace, result="hits")
+        return value
+
+    def put(self, namespace, key, value):
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value, ensure_ascii=False).encode()
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)  # Overwriting an entry only adds the difference
+        except OSError:
+            replaced = 0
+        os.replace(tmp, path)
+        with self.lock:
+            if self.size is None:
+                self.size = self._scan_size()
+            else:
+                self.size += len(data) - replaced
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield st.st_mtime, st.st_size, path
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def evict(self):
+        # Drop least recently used entries until the cache is back under 90% of its budget
+        files = sorted(self._files())
+        size = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, file_size, path in files:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= file_size
+            removed += 1
+        with self.lock:
+            self.size = size
+        logger.info(f"Evicted {removed} cached results")
+
+    def stats(self):
+        with self.lock:
+            namespaces = set(self.hits) | set(self.misses)
+            return {ns: {"hits": self.hits.get(ns, 0), "misses": self.misses.get(ns, 0)} for ns in sorted(namespaces)}
+
+
+result_cache = ResultCache()
@@ -0,0 +1,139 @@
+import argparse
+import glob
+import html
+import os
+import re
+import threading
+from logging import getLogger
+
+from artifacts import ARTIFACT_PATHS
+from store import get_store
+
+logger = getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    UNIQUE (video_id, kind)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(body, tokenize='porter unicode61');
+"""
+
+# Rank hits in titles and abstracts above hits deep in a transcript
+KIND_WEIGHTS = {"title": 4.0, "abstract": 2.0, "summary": 1.5, "transcript": 1.0}
+_MARK_START, _MARK_END = "\x02", "\x03"
+
+
+def _fts_query(text):
+    # Quote every term so user input can't break FTS syntax; the last term matches as a prefix
+    terms = [t.replace('"', '""') for t in re.findall(r'\w+', text)]
+    if not terms:
+        return None
+    return " ".join(f'"{t}"' for t in terms[:-1]) + (" " if len(terms) > 1 else "") + f'"{terms[-1]}"*'
+
+
+class SearchIndex:
+    # SQLite FTS5 index over titles, transcripts, summaries and abstracts, stored next to the
+    # artifact index. Documents are keyed by (video_id, kind) and replaced whenever rewritten.
+    def __init__(self, store=None):
+        self.store = store or get_store()
+        with self.store.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _index(self, conn, video_id, kind, text):
+        row = conn.execute("SELECT id FROM documents WHERE video_id = ? AND kind = ?", (video_id, kind)).fetchone()
+        if row:
+            doc_id = row[0]
+            conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (doc_id,))
+        else:
+            doc_id = conn.execute("INSERT INTO documents (video_id, kind) VALUES (?, ?)", (video_id, kind)).lastrowid
+        conn.execute("INSERT INTO documents_fts (rowid, body) VALUES (?, ?)", (doc_id, text or ""))
+
+    def index(self, video_id, kind, text):
+        with self.store.connection() as conn:
+            self._index(conn, video_id, kind, text)
+
+    def search(self, text, limit=20):
+        query = _fts_query(text)
+        if query is None:
+            return []
+        rows = self.store.connection().execute(
+            f"""
+            SELECT d.video_id, d.kind, v.title,
+                   snippet(documents_fts, 0, '{_MARK_START}', '{_MARK_END}', '…', 24) AS snippet,
+                   bm25(documents_fts) * CASE d.kind {" ".join(f"WHEN '{k}' THEN {w}" for k, w in KIND_WEIGHTS.items())} ELSE 1.0 END AS rank
+            FROM documents_fts
+            JOIN documents d ON d.id = documents_fts.rowid
+            LEFT JOIN videos v ON v.video_id = d.video_id
+            WHERE documents_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+            """, (query, limit * 4)).fetchall()
+        # One result per video, keeping its best-ranked document
+        results, seen = [], set()
+        for row in rows:
+            if row["video_id"] in seen:
+                continue
+            seen.add(row["video_id"])
+            results.append({"video_id": row["video_id"], "kind": row["kind"], "title": row["title"] or row["video_id"],
+                             "snippet": row["snippet"], "rank": row["rank"]})
+            if len(results) >= limit:
+                break
+        return results
+
+    def rebuild(self):
+        # Re-index every artifact on disk and every title in the library, in one transaction
+        count = 0
+        with self.store.connection() as conn:
+            conn.execute("DELETE FROM documents")
+            conn.execute("DELETE FROM documents_fts")
+            for video_id, title in conn.execute("SELECT video_id, title FROM videos").fetchall():
+                if title:
+                    self._index(conn, video_id, "title", title)
+                    count += 1
+            for kind, pattern in ARTIFACT_PATHS.items():
+                for path in glob.glob(pattern.format(video_id="*")):
+                    video_id = os.path.splitext(os.path.basename(path))[0]
+                    with open(path, "r") as f:
+                        self._index(conn, video_id, kind, f.read())
+                    count += 1
+            conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('optimize')")
+        logger.info(f"Re-indexed {count} documents")
+        return count
+
+
+def highlight(snippet):
+    return html.escape(snippet or "").replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+def plain(snippet):
+    return (snippet or "").replace(_MARK_START, "[").replace(_MARK_END, "]")
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex()
+        return _index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full-text search over transcripts, summaries and abstracts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Re-index every existing file")
+    query_parser = subparsers.add_parser("query", help="Search the index")
+    query_parser.add_argument("text")
+    query_parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        print(f"Indexed {get_search_index().rebuild()} documents")
+    else:
+        for result in get_search_index().search(args.text, args.limit):
+            print(f"{result['video_id']}  {result['title']}  ({result['kind']})\n    {plain(result['snippet'])}")
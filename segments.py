@@ -0,0 +1,150 @@
+import os
+import struct
+import zlib
+from logging import getLogger
+
+from utils import lazy_import
+
+logger = getLogger(__name__)
+
+# zlib-compress the text of new segment files. Timings and offsets are never compressed, so they
+# stay memory-mapped either way; only text lookups then need the whole text decompressed once.
+COMPRESS = os.environ.get("SEGMENT_COMPRESS", "0") == "1"
+
+# Timestamped transcript segments, stored column by column so a file can be memory-mapped and
+# searched without parsing it:
+#   header    MAGIC, version, flags, segment count n, text bytes, stored text bytes
+#   starts    float32[n]   segment start, seconds
+#   ends      float32[n]   segment end, seconds
+#   chars     uint32[n+1]  offset of each segment's text in the transcript, in characters
+#   bytes     uint32[n+1]  the same offsets in the UTF-8 text
+#   text      the transcript as UTF-8, zlib-compressed if flags & FLAG_ZLIB
+# The transcript is the segment texts joined by single spaces, the same text as transcripts/<id>.txt.
+MAGIC = b"VSEG"
+VERSION = 1
+FLAG_ZLIB = 1
+HEADER = struct.Struct("<4sHHIQQ")
+
+
+def segments_path(video_id):
+    return f"transcripts/{video_id}.seg"
+
+
+def format_time(seconds):
+    seconds = int(seconds)
+    hours, minutes = divmod(seconds // 60, 60)
+    return f"{hours}:{minutes:02d}:{seconds % 60:02d}" if hours else f"{minutes:02d}:{seconds % 60:02d}"
+
+
+def write_segments(path, segments, compress=COMPRESS):
+    # segments: (start, end, text) in order; empty texts are dropped. Returns the transcript text.
+    np = lazy_import("numpy")
+    segments = [(start, end, text.strip()) for start, end, text in segments if text.strip()]
+    texts = [text for _, _, text in segments]
+    transcript = " ".join(texts)
+    chars, byte_offsets, char, byte = [0], [0], 0, 0
+    for i, text in enumerate(texts):
+        # Each segment's span includes the space that follows it, so spans tile the transcript
+        sep = 1 if i < len(texts) - 1 else 0
+        char += len(text) + sep
+        byte += len(text.encode()) + sep
+        chars.append(char)
+        byte_offsets.append(byte)
+    data = transcript.encode()
+    stored = zlib.compress(data, 6) if compress else data
+    header = HEADER.pack(MAGIC, VERSION, FLAG_ZLIB if compress else 0, len(segments), len(data), len(stored))
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        np.asarray([s[0] for s in segments], dtype="<f4").tofile(f)
+        np.asarray([s[1] for s in segments], dtype="<f4").tofile(f)
+        np.asarray(chars, dtype="<u4").tofile(f)
+        np.asarray(byte_offsets, dtype="<u4").tofile(f)
+        f.write(stored)
+    os.replace(tmp, path)
+    return transcript
+
+
+class SegmentStore:
+    # Read-only view of a segment file. Every lookup is a binary search over the mapped columns.
+    def __init__(self, path):
+        np = lazy_import("numpy")
+        with open(path, "rb") as f:
+            magic, version, self.flags, n, self.text_bytes, stored = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a segment file: {path}")
+        offset = HEADER.size
+        columns = {}
+        for name, dtype, count in (("starts", "<f4", n), ("ends", "<f4", n), ("chars", "<u4", n + 1), ("bytes", "<u4", n + 1)):
+            columns[name] = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,)) if count else np.zeros(count, dtype=dtype)
+            offset += count * np.dtype(dtype).itemsize
+        self.starts, self.ends, self.chars, self.bytes = columns["starts"], columns["ends"], columns["chars"], columns["bytes"]
+        self.blob = np.memmap(path, dtype="u1", mode="r", offset=offset, shape=(stored,)) if stored else b""
+        self._data = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def duration(self):
+        return float(self.ends[-1]) if len(self) else 0.0
+
+    def _raw(self, start, end):
+        if self.flags & FLAG_ZLIB:
+            if self._data is None:
+                self._data = zlib.decompress(bytes(self.blob))
+            return self._data[start:end]
+        return bytes(self.blob[start:end])
+
+    @property
+    def text(self):
+        return self._raw(0, self.text_bytes).decode()
+
+    def segment(self, index):
+        # -> (start, end, text)
+        text = self._raw(int(self.bytes[index]), int(self.bytes[index + 1])).decode().rstrip(" ")
+        return float(self.starts[index]), float(self.ends[index]), text
+
+    def index_at_time(self, seconds):
+        # Index of the last segment starting at or before seconds (0 before the first)
+        np = lazy_import("numpy")
+        return max(int(np.searchsorted(self.starts, seconds, side="right")) - 1, 0)
+
+    def index_at_offset(self, offset):
+        # Index of the segment holding character offset of the transcript
+        np = lazy_import("numpy")
+        return min(max(int(np.searchsorted(self.chars, offset, side="right")) - 1, 0), max(len(self) - 1, 0))
+
+    def time_at(self, offset):
+        # Start time of the segment holding character offset
+        return float(self.starts[self.index_at_offset(offset)]) if len(self) else 0.0
+
+    def between(self, start, end):
+        # Text of every segment overlapping [start, end) seconds
+        np = lazy_import("numpy")
+        first = int(np.searchsorted(self.ends, start, side="right"))
+        last = int(np.searchsorted(self.starts, end, side="left"))
+        if first >= last:
+            return ""
+        return self._raw(int(self.bytes[first]), int(self.bytes[last])).decode().rstrip(" ")
+
+    def span(self, start, end):
+        # -> (start, end) seconds of the segments covering characters [start, end) of the transcript
+        if not len(self):
+            return 0.0, 0.0
+        return float(self.starts[self.index_at_offset(start)]), float(self.ends[self.index_at_offset(max(end - 1, start))])
+
+
+def load_segments(video_id, transcript=None):
+    # The video's segment store, or None if it has none or it was written for a different transcript
+    path = segments_path(video_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        store = SegmentStore(path)
+    except (OSError, ValueError, struct.error) as e:
+        logger.warning(f"Ignoring unreadable segments of {video_id}: {str(e)}")
+        return None
+    if transcript is not None and (store.text_bytes != len(transcript.encode()) or store.text != transcript):
+        return None
+    return store
@@ -0,0 +1,135 @@
+import json
+import os
+import sqlite3
+import threading
+from logging import getLogger
+from time import time as ttime
+
+logger = getLogger(__name__)
+
+DB_PATH = os.environ.get("LIBRARY_DB", "library.db")
+ARTIFACTS = ("transcript", "summary", "abstract")
+SORT_ORDERS = {
+    "Newest": "created_at DESC",
+    "Oldest": "created_at ASC",
+    "Title": "title COLLATE NOCASE ASC",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id TEXT PRIMARY KEY,
+    title TEXT,
+    language TEXT,
+    transcript_path TEXT,
+    summary_path TEXT,
+    abstract_path TEXT,
+    has_transcript INTEGER NOT NULL DEFAULT 0,
+    has_summary INTEGER NOT NULL DEFAULT 0,
+    has_abstract INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS videos_created ON videos(created_at);
+CREATE INDEX IF NOT EXISTS videos_title ON videos(title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS videos_updated ON videos(updated_at);
+"""
+
+
+class ArtifactStore:
+    # Index of every processed video and the artifacts on disk for it. Each thread gets its own
+    # connection; WAL mode lets the UI read while tasks write.
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+        self._migrate_map_json()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _migrate_map_json(self, map_path="map.json"):
+        # One-time import of the old map.json, which is kept as map.json.migrated
+        if not os.path.exists(map_path):
+            return
+        with open(map_path, "r") as f:
+            video_map = json.load(f)
+        now = ttime()
+        rows = []
+        for i, (video_id, item) in enumerate(video_map.items()):
+            # Keep map.json's insertion order as creation order
+            created = now - len(video_map) + i
+            rows.append((video_id, item.get("title"),
+                         f"transcripts/{video_id}.txt", f"summaries/{video_id}.md",
+                         f"abstracts/{video_id}.md" if item.get("abstract") else None,
+                         int(os.path.exists(f"transcripts/{video_id}.txt")), 1,
+                         int(bool(item.get("abstract"))), created, created))
+        with self.connection() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO videos (video_id, title, transcript_path, summary_path, abstract_path, "
+                "has_transcript, has_summary, has_abstract, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows)
+        os.replace(map_path, f"{map_path}.migrated")
+        logger.info(f"Migrated {len(rows)} videos from {map_path} to {self.path}")
+
+    def add_video(self, video_id, title, language=None, **paths):
+        # paths: transcript=..., summary=..., abstract=...; a None or missing path leaves it unchanged
+        now = ttime()
+        values = {"video_id": video_id, "title": title, "language": language, "created_at": now, "updated_at": now}
+        for kind in ARTIFACTS:
+            path = paths.get(kind)
+            values[f"{kind}_path"] = path
+            values[f"has_{kind}"] = int(path is not None)
+        updates = ", ".join(
+            ["title = COALESCE(excluded.title, title)", "language = COALESCE(excluded.language, language)", "updated_at = excluded.updated_at"]
+            + [f"{kind}_path = COALESCE(excluded.{kind}_path, {kind}_path), has_{kind} = MAX(has_{kind}, excluded.has_{kind})" for kind in ARTIFACTS]
+        )
+        columns = ", ".join(values)
+        placeholders = ", ".join(f":{c}" for c in values)
+        with self.connection() as conn:
+            conn.execute(
+                f"INSERT INTO videos ({columns}) VALUES ({placeholders}) ON CONFLICT(video_id) DO UPDATE SET {updates}",
+                values)
+
+    def set_title(self, video_id, title):
+        # -> True if video_id is in the library
+        with self.connection() as conn:
+            cursor = conn.execute("UPDATE videos SET title = ?, updated_at = ? WHERE video_id = ?", (title, ttime(), video_id))
+        return cursor.rowcount > 0
+
+    def get(self, video_id):
+        row = self.connection().execute("SELECT * FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, offset=0, limit=50, order="Newest"):
+        rows = self.connection().execute(
+            f"SELECT video_id, title, has_transcript, has_summary, has_abstract FROM videos "
+            f"ORDER BY {SORT_ORDERS[order]} LIMIT ? OFFSET ?",
+            (limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def last_modified(self):
+        # Changes on every write, including writes from other processes
+        return self.connection().execute("SELECT MAX(updated_at) FROM videos").fetchone()[0]
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore()
+        return _store
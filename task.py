@@ -1,6 +1,11 @@
 from pipeline import download, summarize, transcribe
+from decode import decode
+from store import get_store
+from search import get_search_index
+from workers import StageCancelled
+import metrics
 import logging
-import json
+import threading
 from time import time as ttime
 
 logger = logging.getLogger(__name__)
@@ -11,8 +16,11 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
+STAGES = ("download", "decode", "transcribe", "summarize")
+
+
 class SummarizationTask:
-    def __init__(self, video_id, title, language="en", model_id="openai/whisper-large-v3", sum_model_id="llama3", chunk_size=6000, overlap=500, abstract=True, on_status_change=None):
+    def __init__(self, video_id, title, language="en", model_id="openai/whisper-large-v3", sum_model_id="llama3", chunk_size=6000, overlap=500, abstract=True, on_status_change=None, mode="sequential", concurrency=4, use_derived=True, tokenizer="chars", context_budget=4096):
         self.video_id = video_id
         self.title = title
         self.language = language
@@ -21,26 +29,67 @@ class SummarizationTask:
         self.chunk_size = chunk_size
         self.overlap = overlap
         self.status = "Pending"
+        self.audio_path = None
         self.transcript = None
         self.summary = None
         self.abstract = None
         self.get_abstract = abstract
+        self.mode = mode
+        self.concurrency = concurrency
+        self.use_derived = use_derived
+        self.tokenizer = tokenizer
+        self.context_budget = context_budget
         self.on_status_change = on_status_change
+        self.stop_event = threading.Event()
+        self.timings = {}
+        # runner(kind, kwargs, stop_event, on_status) runs a heavy stage elsewhere, e.g. WorkerPool.run
+        self.runner = None
+        self.job_id = None
+        # Off on remote workers, whose results are added to the coordinator's library instead
+        self.add_to_library = True
+
+    def params(self):
+        # Constructor arguments, stored with the job so it can be rebuilt after a restart
+        return {
+            "video_id": self.video_id, "title": self.title, "language": self.language, "model_id": self.model_id,
+            "sum_model_id": self.sum_model_id, "chunk_size": self.chunk_size, "overlap": self.overlap,
+            "abstract": self.get_abstract, "mode": self.mode, "concurrency": self.concurrency,
+            "use_derived": self.use_derived, "tokenizer": self.tokenizer, "context_budget": self.context_budget,
+        }
+
+    def reset(self, status="Pending"):
+        self.status = status
+        self.stop_event = threading.Event()
+        self.timings = {}
+
+    def _call(self, kind, fn, stop_event, **kwargs):
+        if self.runner is None:
+            return fn(**kwargs, on_status=self.set_status)
+        return self.runner(kind, kwargs, stop_event, self.set_status)
 
     def _download(self, stop_event):
         if stop_event.is_set(): return
         self.set_status("Downloading")
         logger.info(f"Downloading video {self.video_id}")
         start = ttime()
-        download(self.video_id)
+        self.audio_path = download(self.video_id)
         logger.info(f"Downloaded video {self.video_id} in {ttime() - start:.2f} seconds")
 
+    def _decode(self, stop_event):
+        if stop_event.is_set(): return
+        self.set_status("Decoding")
+        logger.info(f"Decoding audio of video {self.video_id}")
+        start = ttime()
+        decode(self.video_id, self.audio_path)
+        logger.info(f"Decoded audio of video {self.video_id} in {ttime() - start:.2f} seconds")
+
     def _transcribe(self, stop_event):
         if stop_event.is_set(): return
         self.set_status("Transcribing")
         logger.info(f"Transcribing video {self.video_id}")
         start = ttime()
-        self.transcript = transcribe(self.video_id, self.model_id, self.language)
+        self.transcript = self._call("transcribe", transcribe, stop_event, video_id=self.video_id,
+                                     model_id=self.model_id, language=self.language)
         logger.info(f"Transcribed video {self.video_id} in {ttime() - start:.2f} seconds")
 
     def _summarize(self, stop_event):
@@ -48,41 +97,64 @@ class SummarizationTask:
         self.set_status("Summarizing")
         logger.info(f"Summarizing video {self.video_id}")
         start = ttime()
-        self.summary, self.abstract = summarize(self.transcript, self.video_id, self.sum_model_id, self.chunk_size, self.overlap, self.get_abstract)
+        self.summary, self.abstract = self._call("summarize", summarize, stop_event, transcript=self.transcript, video_id=self.video_id,
+                                                 model=self.sum_model_id, chunk_size=self.chunk_size, overlap=self.overlap,
+                                                 abstract=self.get_abstract, mode=self.mode, concurrency=self.concurrency,
+                                                 use_derived=self.use_derived, tokenizer=self.tokenizer,
+                                                 context_budget=self.context_budget)
         logger.info(f"Summarized video {self.video_id} in {ttime() - start:.2f} seconds")
 
 
     def _add_mapping(self, stop_event):
         self.set_status("Adding Mapping")
-        video_map = {}
+        get_store().add_video(
+            self.video_id, self.title, self.language,
+            transcript=f"transcripts/{self.video_id}.txt",
+            summary=f"summaries/{self.video_id}.md",
+            abstract=f"abstracts/{self.video_id}.md" if self.abstract else None,
+        )
         try:
-            with open("map.json", "r") as f:
-                video_map = json.load(f)
-        except:
-            pass
-        video_map[self.video_id] = {
-            "title": self.title,
-            "abstract": len(self.abstract) > 0
-        }
-        with open("map.json", "w+") as f:
-            json.dump(video_map, f)
+            get_search_index().index(self.video_id, "title", self.title)
+        except Exception as e:
+            logger.warning(f"Failed to index title of {self.video_id}: {str(e)}")
         self.set_status("Complete")
         logger.info(f"Added mapping for video {self.video_id}")
 
+    def _finish(self, stop_event):
+        self._summarize(stop_event)
+        if stop_event.is_set() or not self.add_to_library: return
+        self._add_mapping(stop_event)
+
+    @property
+    def failed(self):
+        return self.status.startswith("Error")
+
     def set_status(self, status):
         self.status = status
         logger.info(f"Task {self.video_id} status: {self.status}")
         if self.on_status_change:
             self.on_status_change()
 
-    def run(self, stop_event):
+    def run_stage(self, stage, stop_event):
+        runners = {
+            "download": self._download,
+            "decode": self._decode,
+            "transcribe": self._transcribe,
+            "summarize": self._finish,
+        }
+        start = ttime()
         try:
-            self._download(stop_event)
-            if stop_event.is_set(): return
-            self._transcribe(stop_event)
-            if stop_event.is_set(): return
-            self._summarize(stop_event)
-            self._add_mapping(stop_event)
+            runners[stage](stop_event)
+            self.timings[stage] = ttime() - start
+            if not stop_event.is_set():
+                metrics.stage_duration.observe(self.timings[stage], stage=stage)
+        except StageCancelled:
+            logger.info(f"Cancelled {stage} of task {self.video_id}")
         except Exception as e:
             logger.error(f"Error while running task {self.video_id}: {str(e)}")
             self.set_status(f"Error: {str(e)}")
+
+    def run(self, stop_event):
+        for stage in STAGES:
+            if stop_event.is_set() or self.failed: return
+            self.run_stage(stage, stop_event)
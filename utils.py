@@ -1,24 +1,84 @@
 from functools import wraps
+import importlib
 import json
+import logging
+import re
+import sys
+from urllib.parse import parse_qs, urlparse
+from time import perf_counter
 
-import yt_dlp
+logger = logging.getLogger(__name__)
+
+# Seconds spent importing each module loaded through lazy_import
+IMPORT_TIMES = {}
+
+def lazy_import(name):
+    # Import heavy dependencies (torch, transformers, yt_dlp, ollama) only when a stage needs them
+    module = sys.modules.get(name)
+    if module is None:
+        start = perf_counter()
+        module = importlib.import_module(name)
+        IMPORT_TIMES[name] = perf_counter() - start
+        logger.info(f"Imported {name} in {IMPORT_TIMES[name]:.2f} seconds")
+    return module
 
 def load_config(config_file):
     with open(config_file, "r") as f:
         config = json.load(f)
     return config
 
+def get_video_details(video_id):
+    # Title and duration in seconds (None if unknown) from the video's metadata
+    from metadata import get_resolver
+    return get_resolver().details(video_id)
+
 def get_video_info(video_id):
-    video_url = f'https://www.youtube.com/watch?v={video_id}'
-    with yt_dlp.YoutubeDL() as ydl:
-        info_dict = ydl.extract_info(video_url, download=False)
-        video_title = info_dict.get('title', None)
-        return video_title
+    return get_video_details(video_id)["title"]
     
+VIDEO_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def _video(video_id, text):
+    if not VIDEO_ID.match(video_id):
+        raise ValueError(f"Not a YouTube video id: {text}")
+    return "video", video_id
+
+def parse_source(text):
+    # -> ("video", video_id), ("playlist", url) or ("channel", url) for a video id, @handle or youtube url
+    text = text.strip()
+    if "://" not in text and not re.match(r"^(www\.|m\.|music\.)?(youtube\.com|youtu\.be)/", text):
+        if text.startswith("@"):
+            return "channel", f"https://www.youtube.com/{text}/videos"
+        return _video(text, text)
+    url = urlparse(text if "://" in text else f"https://{text}")
+    query = parse_qs(url.query)
+    parts = [part for part in url.path.split("/") if part]
+    if url.netloc.endswith("youtu.be") and parts:
+        return _video(parts[0], text)
+    if "v" in query:
+        return _video(query["v"][0], text)
+    if len(parts) > 1 and parts[0] in ("shorts", "live", "embed"):
+        return _video(parts[1], text)
+    if "list" in query:
+        return "playlist", f"https://www.youtube.com/playlist?list={query['list'][0]}"
+    if parts and parts[0].startswith("@"):
+        return "channel", f"https://www.youtube.com/{parts[0]}/videos"
+    if len(parts) > 1 and parts[0] in ("channel", "c", "user"):
+        return "channel", f"https://www.youtube.com/{parts[0]}/{parts[1]}/videos"
+    raise ValueError(f"Not a YouTube video, playlist or channel: {text}")
+
+def parse_sources(text):
+    # Every source in text, which may list several separated by whitespace or commas, without repeats
+    sources = []
+    for item in re.split(r"[\s,]+", text or ""):
+        if item and not item.startswith("#"):
+            source = parse_source(item)
+            if source not in sources:
+                sources.append(source)
+    return sources
+
 def get_video_id(text):
     # Extract video id from youtube url or return video id
-    if 'youtube.com' in text:
-        video_id = text.split('v=')[-1]
-    else:
-        video_id = text
-    return video_id
\ No newline at end of file
+    kind, value = parse_source(text)
+    if kind != "video":
+        raise ValueError(f"Expected a single video, got a {kind}: {text}")
+    return value
\ No newline at end of file
@@ -0,0 +1,129 @@
+import bisect
+import os
+from logging import getLogger
+
+from decode import SAMPLE_RATE
+from utils import lazy_import
+
+logger = getLogger(__name__)
+
+# Energy-based voice activity detection. Frames louder than the noise floor by VAD_MARGIN_DB count
+# as speech; music beds are loud too, so they are kept, but silence and room tone are skipped.
+ENABLED = os.environ.get("VAD", "1") == "1"
+# Settings that change which audio reaches Whisper; part of the transcript cache key
+PARAMS = {
+    "frame_ms": 30,
+    # Frames quieter than this (dBFS) are never speech, however quiet the recording
+    "floor_db": float(os.environ.get("VAD_FLOOR_DB", "-55")),
+    "margin_db": float(os.environ.get("VAD_MARGIN_DB", "15")),
+    # Pauses shorter than this stay inside a speech region
+    "min_silence": float(os.environ.get("VAD_MIN_SILENCE", "1.0")),
+    # Speech shorter than this is treated as a click or a breath
+    "min_speech": 0.25,
+    # Audio kept around each region so no word is clipped
+    "pad": 0.2,
+    # Silence left between packed regions, so Whisper still hears a pause
+    "gap": 0.3,
+}
+# Frame energies are computed this many seconds at a time, so long audio is never copied whole
+BLOCK_SECONDS = 60
+
+
+def frame_energies(audio, frame):
+    # dBFS of every full frame
+    np = lazy_import("numpy")
+    frames = len(audio) // frame
+    energies = np.empty(frames, dtype=np.float32)
+    block = (BLOCK_SECONDS * SAMPLE_RATE // frame) * frame
+    for start in range(0, frames * frame, block):
+        chunk = np.asarray(audio[start:min(start + block, frames * frame)], dtype=np.float32).reshape(-1, frame)
+        energies[start // frame:start // frame + len(chunk)] = 10 * np.log10(np.square(chunk).mean(axis=1) + 1e-10)
+    return energies
+
+
+def speech_regions(audio, params=PARAMS):
+    # (start, end) sample offsets of the speech in audio, in order
+    np = lazy_import("numpy")
+    frame = SAMPLE_RATE * params["frame_ms"] // 1000
+    energies = frame_energies(audio, frame)
+    if not len(energies):
+        return [(0, len(audio))] if len(audio) else []
+    # The quietest tenth of the audio is taken as the noise floor. Audio with no real pauses has
+    # speech in its quietest tenth, so the threshold never comes within margin_db of the loudest.
+    floor, loud = np.percentile(energies, [10, 90])
+    threshold = max(min(floor + params["margin_db"], loud - params["margin_db"]), params["floor_db"])
+    voiced = np.flatnonzero(energies > threshold)
+    if not len(voiced):
+        return []
+    # Runs of voiced frames, joined across pauses shorter than min_silence
+    max_gap = int(params["min_silence"] * 1000 / params["frame_ms"])
+    breaks = np.flatnonzero(np.diff(voiced) > max_gap)
+    starts = np.concatenate(([voiced[0]], voiced[breaks + 1]))
+    ends = np.concatenate((voiced[breaks], [voiced[-1]])) + 1
+    pad, min_speech = int(params["pad"] * SAMPLE_RATE), int(params["min_speech"] * SAMPLE_RATE)
+    regions = []
+    for start, end in zip(starts * frame, ends * frame):
+        if end - start < min_speech:
+            continue
+        start, end = max(0, int(start) - pad), min(len(audio), int(end) + pad)
+        if regions and start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return regions
+
+
+class PackedAudio:
+    # The speech regions of audio laid end to end with a short silence between them. Slicing
+    # copies only the samples asked for, so the source can stay memory-mapped.
+    def __init__(self, audio, regions, gap=PARAMS["gap"]):
+        self.audio = audio
+        self.gap = int(gap * SAMPLE_RATE)
+        self.regions = regions
+        # packed[i] is where region i starts in the packed audio
+        self.packed = []
+        position = 0
+        for start, end in regions:
+            self.packed.append(position)
+            position += end - start + self.gap
+        self.length = max(position - self.gap, 0)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        np = lazy_import("numpy")
+        start, stop, _ = index.indices(self.length)
+        pieces = []
+        i = max(bisect.bisect_right(self.packed, start) - 1, 0)
+        while start < stop and i < len(self.regions):
+            region_start, region_end = self.regions[i]
+            offset = start - self.packed[i]
+            size = region_end - region_start
+            if offset < size:
+                take = min(size - offset, stop - start)
+                pieces.append(np.asarray(self.audio[region_start + offset:region_start + offset + take], dtype=np.float32))
+                start += take
+            else:
+                take = min(self.packed[i] + size + self.gap - start, stop - start)
+                pieces.append(np.zeros(take, dtype=np.float32))
+                start += take
+                i += 1
+        return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
+
+    def original_time(self, seconds, end=False):
+        # Time in the source audio of a time in the packed audio. Times in a gap map to the end of
+        # the region before it; end times exactly at a region's start stay with the region before.
+        sample = seconds * SAMPLE_RATE
+        i = (bisect.bisect_left if end else bisect.bisect_right)(self.packed, sample) - 1
+        if i < 0:
+            return self.regions[0][0] / SAMPLE_RATE if self.regions else seconds
+        region_start, region_end = self.regions[i]
+        return min(region_start + sample - self.packed[i], region_end) / SAMPLE_RATE
+
+    @property
+    def skipped(self):
+        # Fraction of the source audio left out
+        if not len(self.audio):
+            return 0.0
+        return 1 - sum(end - start for start, end in self.regions) / len(self.audio)
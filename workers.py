@@ -0,0 +1,216 @@
+import importlib
+import logging
+import os
+import subprocess
+import sys
+import threading
+import traceback
+from logging import getLogger
+from multiprocessing.connection import Connection
+
+logger = getLogger(__name__)
+
+# Stage work runs in long-lived child processes so torch and tokenization never compete with the
+# UI for the GIL, models stay loaded across tasks, and a stage can be cancelled by killing its process.
+#
+# The child runs this file as a script and talks to the parent over its stdin/stdout pipes:
+#   parent -> child: ("init", "module:function", args)   run once before any job
+#                    ("warm", model_id, language)          load an ASR model in the background
+#                    ("run", job_id, kind, kwargs)         run JOBS[kind](**kwargs, on_status=...)
+#                    ("stop",)                             exit
+#   child -> parent: ("status", job_id, text)              progress of the running job
+#                    ("progress", method, args)            progress.channel call to replay in the parent
+#                    ("metrics", values)                   metrics recorded since the last message
+#                    ("done", job_id, result) | ("error", job_id, message)
+
+JOBS = {
+    "transcribe": "pipeline:transcribe",
+    "summarize": "pipeline:summarize",
+}
+# Seconds a cancelled worker gets to exit after SIGTERM before it is killed
+KILL_TIMEOUT = 3.0
+POLL_INTERVAL = 0.2
+
+
+class StageCancelled(Exception):
+    pass
+
+
+def _resolve(path):
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class WorkerProcess:
+    def __init__(self, kind, initializer=None):
+        self.kind = kind
+        self.initializer = initializer
+        self.jobs = 0
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=os.getcwd(),
+        )
+        self.reader = Connection(os.dup(self.proc.stdout.fileno()), writable=False)
+        self.writer = Connection(os.dup(self.proc.stdin.fileno()), readable=False)
+        self.proc.stdout.close()
+        self.proc.stdin.close()
+        if initializer:
+            self.send("init", *initializer)
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def send(self, *message):
+        self.writer.send(message)
+
+    def run(self, job_id, kwargs, stop_event=None, on_status=None):
+        import metrics
+        import progress
+
+        self.jobs += 1
+        self.send("run", job_id, self.kind, kwargs)
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                self.kill()
+                raise StageCancelled(f"{self.kind} cancelled")
+            try:
+                if not self.reader.poll(POLL_INTERVAL):
+                    continue
+                message = self.reader.recv()
+            except (EOFError, OSError):
+                self.kill()
+                raise Exception(f"{self.kind} worker exited unexpectedly (code {self.proc.returncode})")
+            if message[0] == "metrics":
+                metrics.registry.merge(message[1])
+            elif message[0] == "status":
+                if on_status:
+                    on_status(message[2])
+            elif message[0] == "progress":
+                getattr(progress.channel, message[1])(*message[2])
+            elif message[0] == "done":
+                return message[2]
+            elif message[0] == "error":
+                raise Exception(message[2])
+
+    def kill(self):
+        if self.alive:
+            self.proc.terminate()
+            try:
+                self.proc.wait(KILL_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self.reader.close()
+        self.writer.close()
+
+    def close(self):
+        try:
+            self.send("stop")
+            self.proc.wait(KILL_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+
+class WorkerPool:
+    # Idle worker processes per job kind. A worker whose job is cancelled or crashes is replaced
+    # by a fresh one, so cancellation costs a process start and a model reload, not a hung stage.
+    def __init__(self, sizes, initializer=None):
+        # initializer is ("module:function", args), run in every worker before its first job
+        self.initializer = initializer
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.idle = {kind: [WorkerProcess(kind, initializer) for _ in range(n)] for kind, n in sizes.items()}
+        self.closed = False
+        self.counter = 0
+
+    def run(self, kind, kwargs, stop_event=None, on_status=None):
+        with self.available:
+            while not self.idle[kind] and not self.closed:
+                self.available.wait()
+            if self.closed:
+                raise StageCancelled("worker pool is closed")
+            worker = self.idle[kind].pop()
+            self.counter += 1
+            job_id = self.counter
+        try:
+            return worker.run(job_id, kwargs, stop_event, on_status)
+        finally:
+            if not worker.alive or worker.reader.closed:
+                logger.info(f"Replacing {kind} worker after {worker.jobs} jobs")
+                worker.kill()
+                worker = WorkerProcess(kind, self.initializer)
+            with self.available:
+                if self.closed:
+                    worker.close()
+                else:
+                    self.idle[kind].append(worker)
+                    self.available.notify()
+
+    def warm_up(self, model_id, language):
+        # Ask every idle transcription worker to start loading the model; jobs sent afterwards wait for it
+        with self.lock:
+            workers = list(self.idle.get("transcribe", []))
+        for worker in workers:
+            try:
+                worker.send("warm", model_id, language)
+            except OSError:
+                pass
+
+    def close(self):
+        with self.available:
+            self.closed = True
+            workers = [w for kind in self.idle.values() for w in kind]
+            for kind in self.idle.values():
+                kind.clear()
+            self.available.notify_all()
+        for worker in workers:
+            worker.close()
+
+
+def _serve(reader, writer):
+    import metrics
+    import progress
+    from asr import registry
+
+    send_lock = threading.Lock()
+
+    def send(*message):
+        with send_lock:
+            writer.send(message)
+
+    progress.channel.listener = lambda method, args: send("progress", method, args)
+
+    while True:
+        try:
+            message = reader.recv()
+        except EOFError:
+            return
+        if message[0] == "stop":
+            return
+        if message[0] == "init":
+            _resolve(message[1])(*message[2])
+        elif message[0] == "warm":
+            registry.warm_up(message[1], message[2])
+        elif message[0] == "run":
+            _, job_id, kind, kwargs = message
+            try:
+                result = _resolve(JOBS[kind])(**kwargs, on_status=lambda text: send("status", job_id, text))
+                reply = ("done", job_id, result)
+            except Exception as e:
+                logger.debug(traceback.format_exc())
+                reply = ("error", job_id, str(e))
+            send("metrics", metrics.registry.drain())
+            send(*reply)
+
+
+if __name__ == "__main__":
+    # Keep the protocol pipes private: anything printed goes to stderr instead
+    reader = Connection(os.dup(0), writable=False)
+    writer = Connection(os.dup(1), readable=False)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(2, 1)
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s - worker {os.getpid()} - %(name)s - %(levelname)s - %(message)s")
+    _serve(reader, writer)